@@ -35,7 +35,8 @@ setup(author="Dih5",
       extras_require={
           "docs": ["nbsphinx", "sphinx-rtd-theme", "IPython"],
           "test": ["pytest"],
-          "progress": ["tqdm"]
+          "progress": ["tqdm"],
+          "arrow": ["pyarrow"],
       },
       keywords=[],
       long_description=long_description,
@@ -3,7 +3,34 @@
 __version__ = '0.3.0'
 __author__ = 'Dih5 <dihedralfive@gmail.com>'
 
-from .base import Experiment, Variable, SubExperiment
-from .plot import highlight_max, highlight_threshold
-from .analysis import paired_t_test, format_mag_err, df_agg_mean
-from .metrics import get_classification_metrics, plot_confusion_matrix
+from .base import Experiment, Variable, SubExperiment, RangeVariable, LinSpaceVariable, LogSpaceVariable
+
+# Names imported from their modules on first access, avoiding to load pandas, scipy or sklearn if not needed
+_lazy_attributes = {
+    "highlight_max": "plot",
+    "highlight_threshold": "plot",
+    "paired_t_test": "analysis",
+    "format_mag_err": "analysis",
+    "format_mag_err_array": "analysis",
+    "df_agg_mean": "analysis",
+    "df_agg_bootstrap": "analysis",
+    "get_classification_metrics": "metrics",
+    "get_classification_metrics_batch": "metrics",
+    "plot_confusion_matrix": "metrics",
+    "memoize": "cache",
+    "Pipeline": "pipeline",
+}
+
+__all__ = ["Experiment", "Variable", "SubExperiment", "RangeVariable", "LinSpaceVariable", "LogSpaceVariable",
+           *_lazy_attributes]
+
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        from importlib import import_module
+        return getattr(import_module("." + _lazy_attributes[name], __name__), name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazy_attributes))
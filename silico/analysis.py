@@ -1,7 +1,7 @@
 from math import log10, floor
 
 import numpy as np
-from scipy.stats import ttest_rel
+from scipy.special import stdtr
 import pandas as pd
 
 
@@ -11,6 +11,9 @@ def paired_t_test(df, col_left, col_right, common_col="seed"):
 
     Considered calling .round(5) or alike on output for clearer reading.
 
+    The paired differences are arranged in a dense (groups, repetitions) array, so the statistics of all the groups
+    are computed at once.
+
     Args:
         df (pd.DataFrame): The results of the experiment.
         col_left (str): Name of the "left" column to compare
@@ -20,10 +23,10 @@ def paired_t_test(df, col_left, col_right, common_col="seed"):
     Returns:
         pd.Dataframe: Dataframe with the mean values of the left and right column, as well as the p-values of unilateral
                       tests. p-value-less corresponds to the test with alternative hypothesis col_left < col_right.
+                      If common_col is the only level of the index, a single row is returned.
 
     """
-    # TODO: Single level not considered
-    group_cols = [level.name for level in df.index.levels]
+    group_cols = list(df.index.names)
     if common_col not in group_cols:
         raise ValueError("Common column %s not found." % common_col)
     for c in [col_left, col_right]:
@@ -31,29 +34,40 @@ def paired_t_test(df, col_left, col_right, common_col="seed"):
             raise ValueError("Column %s not found" % c)
     group_cols.remove(common_col)
 
-    df_eval = df.groupby(group_cols).agg(list)
+    if group_cols:
+        grouped = df.groupby(group_cols)
+        df_mean = grouped[[col_left, col_right]].agg("mean")
+        codes = grouped.ngroup().to_numpy()
+        positions = grouped.cumcount().to_numpy()
+    else:
+        df_mean = df[[col_left, col_right]].mean().to_frame().T
+        codes = np.zeros(len(df), dtype=int)
+        positions = np.arange(len(df))
+
+    # Rows whose group keys are missing are not part of any group
+    valid = codes >= 0
+    codes = codes[valid].astype(int)
+    positions = positions[valid].astype(int)
+    diff = (df[col_left].to_numpy(dtype=float) - df[col_right].to_numpy(dtype=float))[valid]
+
+    n_groups = len(df_mean)
+    dense = np.full((n_groups, positions.max() + 1 if len(positions) else 0), np.nan)
+    dense[codes, positions] = diff
+    n = np.bincount(codes, minlength=n_groups)
+    # As in ttest_rel, a nan in a group propagates to its p-values
+    has_nan = np.bincount(codes, weights=np.isnan(diff), minlength=n_groups) > 0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.nansum(dense, axis=1) / n
+        var = np.nansum((dense - mean.reshape(-1, 1)) ** 2, axis=1) / (n - 1)
+        t = mean / np.sqrt(var / n)
+    t[has_nan] = np.nan
 
     df_out = pd.concat(
         (
-            df.groupby(group_cols)[[col_left, col_right]].agg("mean"),
-            pd.Series(
-                df_eval.apply(
-                    lambda row: ttest_rel(
-                        row[col_left], row[col_right], alternative="less"
-                    ).pvalue,
-                    axis=1,
-                ),
-                name="p-value-less",
-            ),
-            pd.Series(
-                df_eval.apply(
-                    lambda row: ttest_rel(
-                        row[col_left], row[col_right], alternative="greater"
-                    ).pvalue,
-                    axis=1,
-                ),
-                name="p-value-greater",
-            ),
+            df_mean,
+            pd.Series(stdtr(n - 1, t), index=df_mean.index, name="p-value-less"),
+            pd.Series(stdtr(n - 1, -t), index=df_mean.index, name="p-value-greater"),
         ),
         axis=1,
     )
@@ -96,13 +110,66 @@ def format_mag_err(mag, err, sep=" ± ", increase=0, increase_ones=True):
     return "%s%s%s" % (mag, sep, err)
 
 
-def _format_err(row):
-    out = {}
-    for var in row.index.levels[0]:
-        out[var] = format_mag_err(row[var]["mean"], row[var]["sem"])
+def format_mag_err_array(mag, err, sep=" ± ", increase=0, increase_ones=True):
+    """
+    Format arrays of magnitudes and their errors as strings
+
+    The output is identical to applying format_mag_err to each pair, but the orders of magnitude, the rounding and
+    the formatting are done for all the elements sharing the number of digits at once.
+
+    Args:
+        mag (np.ndarray): Values of the magnitudes.
+        err (np.ndarray): Values of the associated errors.
+        sep (str): Characters to use to join the numbers. Include spaces if needed.
+        increase (int): A number to increase (or decrease if negative) the number of significant digits.
+        increase_ones (bool): Whether the number of significant digits increases by one when the leading digit is one.
+
+    Returns:
+        np.ndarray: An array of strings with the representations of the magnitudes with their errors.
+
+    """
+    mag, err = np.broadcast_arrays(np.asarray(mag), np.asarray(err))
+    out = np.empty(mag.shape, dtype=object)
+
+    special = np.isnan(err) | (err == 0)
+    for i in zip(*np.nonzero(special)):
+        # Not a number or zero error, as in format_mag_err
+        out[i] = "%s%s%s" % (mag[i], sep, err[i] if np.isnan(err[i]) else 0)
+
+    regular = ~special
+    m = mag[regular]
+    e = err[regular]
+    if np.any(e < 0):
+        raise ValueError("math domain error")
+    order = np.floor(np.log10(e)).astype(int)
+    if increase_ones:
+        # Powers computed by Python (as in format_mag_err), since np.power may differ in the last digit
+        orders, inverse = np.unique(order, return_inverse=True)
+        powers = np.array([float(10 ** int(o)) for o in orders])[inverse.reshape(order.shape)]
+        order[np.floor(e / powers) == 1.0] -= 1  # Leading digit is 1
+    order -= increase
+
+    mag_str = np.empty(m.shape, dtype=object)
+    err_str = np.empty(m.shape, dtype=object)
+    for o in np.unique(order):
+        selected = order == o
+        if o < 0:
+            fmt = "%%.%df" % -o
+            mag_str[selected] = np.char.mod(fmt, m[selected])
+            err_str[selected] = np.char.mod(fmt, e[selected])
+        else:
+            mag_str[selected] = np.char.mod("%d", np.round(m[selected], -o))
+            err_str[selected] = np.char.mod("%d", np.round(e[selected], -o))
+    out[regular] = mag_str + sep + err_str
     return out
 
 
+def _format_err(df_agg, mag_col, err_col):
+    """Format the pairs of columns of each variable in an aggregated dataframe"""
+    return pd.DataFrame({var: format_mag_err_array(df_agg[(var, mag_col)].to_numpy(), df_agg[(var, err_col)].to_numpy())
+                         for var in df_agg.columns.levels[0]}, index=df_agg.index)
+
+
 def df_agg_mean(df, group_cols, raw=False):
     """
     Aggregate a dataframe to summarize it with the mean and its error
@@ -120,4 +187,112 @@ def df_agg_mean(df, group_cols, raw=False):
     df_agg = df.groupby(group_cols).agg(['mean', 'sem'])
     if raw:
         return df_agg
-    return df_agg.apply(_format_err, axis=1, result_type="expand")
+    return _format_err(df_agg, "mean", "sem")
+
+
+def _apply_statistic(statistic, values, axis):
+    """Apply a statistic given by its name or as a callable with an axis argument"""
+    if statistic == "mean":
+        return np.nanmean(values, axis=axis)
+    elif statistic == "median":
+        return np.nanmedian(values, axis=axis)
+    return statistic(values, axis=axis)
+
+
+def _bootstrap_chunk(block, indices, statistic, percentiles):
+    """
+    Bootstrap a set of groups of the same size
+
+    Args:
+        block (np.ndarray): Values of the groups, with shape (groups, size, variables).
+        indices (np.ndarray): Resample indices, with shape (n_boot, size).
+        statistic (str or callable): The statistic.
+        percentiles (list of float): Percentiles of the bootstrap distribution to return.
+
+    Returns:
+        np.ndarray: Array with shape (groups, 1 + len(percentiles), variables) with the statistic and the percentiles.
+
+    """
+    import warnings
+    with warnings.catch_warnings():
+        # All-nan groups produce nan, as in the mean
+        warnings.simplefilter("ignore", RuntimeWarning)
+        point = _apply_statistic(statistic, block, axis=1)
+        boot = _apply_statistic(statistic, block[:, indices, :], axis=2)
+        limits = np.nanpercentile(boot, percentiles, axis=1)
+    return np.concatenate([point[:, np.newaxis, :], np.moveaxis(limits, 0, 1)], axis=1)
+
+
+def df_agg_bootstrap(df, group_cols, n_boot=1000, ci=0.95, statistic="mean", raw=False, seed=None, processes=None,
+                     chunk_size=2 ** 24):
+    """
+    Aggregate a dataframe to summarize it with a statistic and its bootstrap (percentile) confidence interval
+
+    The resample indices are drawn once for all the groups with the same size, so the statistic is computed for all
+    of them in a batch.
+
+    Args:
+        df (pd.DataFrame): The dataframe.
+        group_cols (list of str): Columns used as index for the aggregation.
+        n_boot (int): Number of bootstrap resamples.
+        ci (float): Confidence level of the interval.
+        statistic (str or callable): Either "mean", "median" or a function with an axis argument (e.g., np.nanstd).
+        raw (bool): If False, the result is a table of strings representing the statistic with the half-width of
+                    the interval as its error. If True, the columns will have an additional level providing the
+                    statistic, the limits of the interval (low, high) and its half-width (err).
+        seed (int): Seed used to draw the resamples.
+        processes (int): Number of processes used to spread the groups. If None, the current process is used.
+        chunk_size (int): Maximum number of resampled values computed at once.
+
+    Returns:
+        pd.DataFrame: The summarizing dataframe
+
+    """
+    grouped = df.groupby(group_cols)
+    columns = [c for c in df.columns if c not in group_cols]
+    codes = grouped.ngroup().to_numpy()
+    valid = codes >= 0
+    codes = codes[valid].astype(int)
+    values = df[columns].to_numpy(dtype=float)[valid]
+
+    index = grouped.size().index
+    n_groups = len(index)
+    order = np.argsort(codes, kind="stable")
+    values = values[order]
+    sizes = np.bincount(codes, minlength=n_groups)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+    percentiles = [(1 - ci) / 2 * 100, (1 + ci) / 2 * 100]
+    rng = np.random.default_rng(seed)
+    jobs = []
+    for size in np.unique(sizes):
+        groups = np.flatnonzero(sizes == size)
+        indices = rng.integers(0, size, size=(n_boot, size))
+        step = max(1, chunk_size // max(1, n_boot * size * len(columns)))
+        for i in range(0, len(groups), step):
+            chunk = groups[i:i + step]
+            block = values[starts[chunk].reshape(-1, 1) + np.arange(size)]
+            jobs.append((chunk, (block, indices, statistic, percentiles)))
+
+    out = np.empty((n_groups, 3, len(columns)))
+    if processes is None:
+        for chunk, args in jobs:
+            out[chunk] = _bootstrap_chunk(*args)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(processes) as executor:
+            futures = [(chunk, executor.submit(_bootstrap_chunk, *args)) for chunk, args in jobs]
+            for chunk, future in futures:
+                out[chunk] = future.result()
+
+    name = statistic if isinstance(statistic, str) else getattr(statistic, "__name__", "statistic")
+    data = {}
+    for j, column in enumerate(columns):
+        data[(column, name)] = out[:, 0, j]
+        data[(column, "low")] = out[:, 1, j]
+        data[(column, "high")] = out[:, 2, j]
+        data[(column, "err")] = (out[:, 2, j] - out[:, 1, j]) / 2
+    df_agg = pd.DataFrame(data, index=index)
+    if raw:
+        return df_agg
+    return _format_err(df_agg, name, "err")
@@ -1,29 +1,39 @@
 import warnings
-from itertools import product
+from itertools import product, islice
 import base64
+import functools
 import hashlib
+import inspect
 import json
+import numbers
 import os
 import pickle
-from glob import glob
-from datetime import datetime
+import threading
+from glob import glob, escape as glob_escape
+from fnmatch import fnmatchcase
+import time
+from datetime import datetime, timedelta
 from multiprocessing import Pool
+from multiprocessing.util import Finalize
 import traceback
+import math
+from collections.abc import Sequence
+from contextlib import closing
 
-try:
-    import pandas as pd
-except ImportError:
-    pd = None
+from .common import prod, set_kwargs, exceeds_deadline, RunningStats, resolve_inner_threads, limit_inner_threads, \
+    get_inner_threads, reset_peak_rss, get_peak_rss
+from .writer import get_writer, MemoryStore, _write_file
 
-try:
-    from tqdm.auto import tqdm
-except ImportError:
-    def tqdm(*args, **kwargs):
+
+def tqdm(*args, **kwargs):
+    """Wrap an iterable with a progress bar if tqdm is available (imported on first use)"""
+    try:
+        from tqdm.auto import tqdm as _tqdm
+    except ImportError:
         if args:
             return args[0]
         return kwargs["iterable"]
-
-from .common import prod, set_kwargs
+    return _tqdm(*args, **kwargs)
 
 
 def _hash_function(w):
@@ -32,10 +42,242 @@ def _hash_function(w):
     return base64.b64encode(h.digest())[:12].decode("utf-8").replace("/", "_")
 
 
+def function_fingerprint(f, version=None):
+    """
+    Get a string identifying the implementation of a function
+
+    Args:
+        f (callable): The function. Its source is used if available, otherwise its bytecode and constants.
+                      For partial functions and callable objects, the wrapped function and the class are used.
+        version (str): A version provided by the user, also included in the fingerprint.
+
+    Returns:
+        str: The fingerprint.
+
+    """
+    parts = [] if version is None else [str(version)]
+    while isinstance(f, functools.partial):
+        parts.append(repr((f.args, sorted(f.keywords.items()))))
+        f = f.func
+    target = f if inspect.isfunction(f) or inspect.ismethod(f) or inspect.isclass(f) else type(f)
+    try:
+        parts.append(inspect.getsource(target))
+    except (OSError, TypeError):  # Source not available (e.g., defined in an interactive session)
+        code = getattr(inspect.unwrap(target), "__code__", None)
+        if code is None:
+            parts.append(getattr(target, "__qualname__", repr(target)))
+        else:
+            parts.append(repr((code.co_code, code.co_consts, code.co_names)))
+    return _hash_function("\n".join(parts).encode("utf-8"))
+
+
+class Checkpoint:
+    """A handle to store and restore the partial state of a trial, allowing to resume it if interrupted"""
+
+    def __init__(self, path, memory=None):
+        """
+
+        Args:
+            path (str): Path of the file storing the state.
+            memory (MemoryStore): If given, the state is kept there (see Experiment's storage) instead of in the file.
+
+        """
+        self.path = path
+        self.memory = memory
+
+    def save(self, state):
+        """Store the state, replacing the previous one atomically"""
+        if self.memory is not None:
+            self.memory.put(self.path, state)
+            return
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def load(self, default=None):
+        """Load the last stored state, or return default if there is none"""
+        if self.memory is not None and self.memory.contains(self.path):
+            return self.memory.get(self.path)
+        try:
+            with open(self.path, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return default
+
+    def exists(self):
+        """Check if a state is stored"""
+        return (self.memory is not None and self.memory.contains(self.path)) or os.path.exists(self.path)
+
+    def delete(self):
+        """Remove the stored state, if any"""
+        if self.memory is not None:
+            self.memory.discard(self.path)
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class _ErrorRecord:
+    """An entry of the index of errored trials, stored as a small file next to the results of the trial"""
+
+    def __init__(self, path, memory=None):
+        """
+
+        Args:
+            path (str): Path of the file storing the entry.
+            memory (MemoryStore): If given, the entry is kept there (see Experiment's storage) instead of in the file.
+
+        """
+        self.path = path
+        self.memory = memory
+
+    def load(self):
+        """Load the entry, a dict with the kwargs of the trial, its failed attempts and the time of the last one"""
+        if self.memory is not None and self.memory.contains(self.path):
+            return self.memory.get(self.path)
+        try:
+            with open(self.path, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:  # Not in the index
+            return None
+
+    def save(self, kwargs, attempts):
+        """Add the trial to the index after a failed attempt, replacing its previous entry atomically"""
+        record = {"kwargs": kwargs, "attempts": attempts, "time": time.time()}
+        if self.memory is not None:
+            self.memory.put(self.path, record)
+            return
+        _write_file(self.path, pickle.dumps(record))
+
+    def delete(self):
+        """Remove the trial from the index, if there"""
+        if self.memory is not None:
+            self.memory.discard(self.path)
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class RunHandle:
+    """A handle to a run of an experiment in a background thread (see Experiment.run_all)"""
+
+    def __init__(self, experiment, total):
+        """
+
+        Args:
+            experiment (Experiment): The experiment being run.
+            total (int): The number of trials to consider, or None if unknown.
+
+        """
+        self.experiment = experiment
+        self.total = total
+        self.done = 0
+        self.ran = 0
+        self._started = time.monotonic()
+        self._finished = None
+        self._cancel_event = threading.Event()
+        self._exception = None
+        self._thread = None
+
+    def _start(self, target):
+        def run():
+            try:
+                target()
+            except BaseException as e:
+                self._exception = e
+            finally:
+                self._finished = time.monotonic()
+
+        self._thread = threading.Thread(target=run, name="silico-run", daemon=True)
+        self._thread.start()
+
+    def _update(self, spent):
+        self.done += 1
+        if spent is not None:
+            self.ran += 1
+
+    @property
+    def cancelled(self):
+        """Whether the run was cancelled"""
+        return self._cancel_event.is_set()
+
+    def running(self):
+        """Check if the run has not finished yet"""
+        return self._finished is None
+
+    def elapsed(self):
+        """Seconds since the run started, until it finished"""
+        return (self._finished if self._finished is not None else time.monotonic()) - self._started
+
+    def progress(self):
+        """
+        Report the progress of the run
+
+        Returns:
+            dict of str: A mapping of statistics of the run, including:
+                             - total: The number of trials considered, or None if unknown.
+                             - done: The trials finished or skipped because they were available.
+                             - ran: The trials run.
+                             - elapsed_seconds: Seconds since the run started, until it finished.
+
+        """
+        return {"total": self.total, "done": self.done, "ran": self.ran, "elapsed_seconds": self.elapsed()}
+
+    @property
+    def throughput(self):
+        """Trials run per second"""
+        elapsed = self.elapsed()
+        return self.ran / elapsed if elapsed > 0 else 0.0
+
+    def wait(self, timeout=None):
+        """
+        Wait for the run to finish, raising the exception which stopped it, if any
+
+        Args:
+            timeout (float): Maximum number of seconds to wait. None to wait until it finishes.
+
+        Returns:
+            bool: Whether the run finished.
+
+        """
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            return False
+        if self._exception is not None:
+            raise self._exception
+        return True
+
+    def cancel(self, wait=True, timeout=None):
+        """
+        Stop the run. No new trials are started; those running in threads (or sequentially) are finished, since they
+        cannot be stopped, while those in processes are killed.
+
+        Args:
+            wait (bool): Whether to wait for the run to stop.
+            timeout (float): Maximum number of seconds to wait. None to wait until it stops.
+
+        Returns:
+            bool: Whether the run stopped.
+
+        """
+        self._cancel_event.set()
+        if wait:
+            return self.wait(timeout)
+        return not self.running()
+
+    def partial_results_df(self, **kwargs):
+        """Get a DataFrame with the results available so far (see Experiment.get_results_df for the arguments)"""
+        return self.experiment.get_results_df(**kwargs)
+
+
 class Trial:
     """A Trial able to provide a result from a dict of parameters"""
 
-    def __init__(self, kwargs, f, base_path="", base_name=None):
+    def __init__(self, kwargs, f, base_path="", base_name=None, extra_kwargs=None, checkpoint_arg=None,
+                 fingerprint=None, writer=None):
         """
 
         Args:
@@ -43,10 +285,21 @@ class Trial:
             f (callable): Function called when performing the trial.
             base_path (str): Path to the storage dir.
             base_name (str): Prefix for the file name. If None, a name will be extracted from f.
+            extra_kwargs (dict): Additional arguments to use in the call, which do not identify the trial (they are not
+                                 part of its hash).
+            checkpoint_arg (str): Name of an argument of f receiving a Checkpoint of the trial, used to store its partial
+                                  state. If None, no checkpoint is used.
+            fingerprint (str): A fingerprint of f, stored as "_fingerprint" with the running information.
+            writer (BatchWriter or MemoryStore): Where the results are kept before being stored in their files. If None,
+                                                 they are stored when saved.
 
         """
         self.kwargs = kwargs
         self.f = f
+        self.extra_kwargs = extra_kwargs if extra_kwargs is not None else {}
+        self.checkpoint_arg = checkpoint_arg
+        self.fingerprint = fingerprint
+        self.writer = writer
         self.base_path = base_path
 
         self.base_name = base_name if base_name is not None else f.__name__
@@ -62,29 +315,110 @@ class Trial:
         """Get a unique filename for the trial"""
         return "%s-%s%s" % (self.base_name, self.get_hash(), extension)
 
+    def _memory_store(self):
+        """The store keeping the results in memory, if any, where the checkpoint and error record are kept too"""
+        return self.writer if isinstance(self.writer, MemoryStore) else None
+
+    def get_checkpoint(self):
+        """Get the checkpoint of the trial, stored next to its results"""
+        return Checkpoint(os.path.join(self.base_path, self.get_file_name(".ckpt")), memory=self._memory_store())
+
+    def get_error_record(self):
+        """Get the entry of the trial in the index of errored trials, stored next to its results"""
+        return _ErrorRecord(os.path.join(self.base_path, self.get_file_name(".err")), memory=self._memory_store())
+
+    def get_attempts(self):
+        """Get the number of the next attempt to run the trial, counting the errors recorded in the index"""
+        record = self.get_error_record().load()
+        return 1 if record is None else record["attempts"] + 1
+
+    def record_error(self, attempts):
+        """Add the trial to the index of errored trials"""
+        self.get_error_record().save(self.kwargs, attempts)
+
     def run(self):
         """Execute the trial"""
-        return self.f(**self.kwargs)
+        if self.checkpoint_arg is not None:
+            return self.f(**self.kwargs, **self.extra_kwargs, **{self.checkpoint_arg: self.get_checkpoint()})
+        return self.f(**self.kwargs, **self.extra_kwargs)
+
+    def run_and_save(self, add_stats=True, record_memory=False):
+        """
+        Execute the trial and store the results as a pickle and in the db
+
+        If the trial uses a checkpoint, it is removed after a successful run, but kept if an error is stored.
 
-    def run_and_save(self, add_stats=True):
-        """Execute the trial and store the results as a pickle and in the db"""
+        Stored errors are recorded in the index of errored trials, which is used to retry them. Retried trials add the
+        number of attempts ("_attempts") to the running information.
+
+        If record_memory, the peak resident set size in bytes of the process while running the trial ("_peak_rss") is
+        added to the running information. The peak can only be reset in Linux, elsewhere it is that of the process.
+        """
+        attempts = self.get_attempts()
+        if record_memory:
+            reset_peak_rss()
         start = datetime.now()
+        failed = False
         try:
             result = self.run()
         except Exception as e:
             if add_stats:
                 result = {"_error": traceback.format_exc()}
+                failed = True
             else:
                 raise e
         if add_stats:
             elapsed = datetime.now() - start
-            result = {"_run_start": str(start), "_elapsed_seconds": elapsed.total_seconds(), **result}
-        pickle.dump(result, open(os.path.join(self.base_path, self.get_file_name()), "wb"))
+            result = {**self.get_stats(start, elapsed.total_seconds(), attempts), **result}
+            if record_memory:
+                result["_peak_rss"] = get_peak_rss()
+        self.save(result)
+        if failed:
+            self.record_error(attempts)
+        else:
+            if self.checkpoint_arg is not None:
+                self.get_checkpoint().delete()
+            if attempts > 1:
+                self.get_error_record().delete()
         return result
 
+    def get_stats(self, start, elapsed, attempts=1):
+        """Get the running information added to the results"""
+        stats = {"_run_start": str(start), "_elapsed_seconds": elapsed}
+        if attempts > 1:
+            stats["_attempts"] = attempts
+        if get_inner_threads() is not None:
+            stats["_inner_threads"] = get_inner_threads()
+        if self.fingerprint is not None:
+            stats["_fingerprint"] = self.fingerprint
+        return stats
+
+    def save(self, result):
+        """Store the given results of the trial"""
+        path = os.path.join(self.base_path, self.get_file_name())
+        if self.writer is not None:
+            self.writer.put(path, result)
+            return
+        # Write and rename, so readers (or copies of the trial being killed) never leave a partial file
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            pickle.dump(result, f)
+        os.replace(tmp_path, path)
+
     def load(self):
         """Load the results of the trial if available"""
-        return pickle.load(open(os.path.join(self.base_path, self.get_file_name()), "rb"))
+        path = os.path.join(self.base_path, self.get_file_name())
+        if self.writer is not None:
+            result = self.writer.get(path)
+            if result is not None:
+                return result
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def is_available(self):
+        """Check if the results of the trial are stored"""
+        path = os.path.join(self.base_path, self.get_file_name())
+        return (self.writer is not None and self.writer.contains(path)) or os.path.exists(path)
 
     def load_or_run(self, add_stats=True):
         """Load the results if available, otherwise running the trial, storing the results, and returning them"""
@@ -95,8 +429,15 @@ class Trial:
         return self.run_and_save(add_stats=add_stats)
 
     def delete(self):
-        """Remove the stored results of the trial"""
-        os.remove(self.get_file_name())
+        """Remove the stored results of the trial, as well as its checkpoint and its entry in the error index"""
+        self.get_checkpoint().delete()
+        self.get_error_record().delete()
+        path = os.path.join(self.base_path, self.get_file_name())
+        if self.writer is not None and self.writer.contains(path):
+            self.writer.discard(path)
+            if not os.path.exists(path):
+                return
+        os.remove(path)
 
 
 def ensure_dir_exists(path):
@@ -135,6 +476,8 @@ class GridVariable(Variable):
     def __init__(self, name, grid, standard=None):
         super(GridVariable, self).__init__(name, standard=standard)
         self.grid = grid
+        self._indices = None
+        self._values = None
 
     def iter_values(self):
         for v in self.grid:
@@ -147,10 +490,188 @@ class GridVariable(Variable):
         length = len(l)
         return sorted(l)[length // 2]
 
+    def index_of(self, value):
+        """Get the position of a value in the grid"""
+        if self._indices is None:
+            self._indices = {json.dumps(v, sort_keys=True): i for i, v in enumerate(self.iter_values())}
+        return self._indices[json.dumps(value, sort_keys=True)]
+
+    def __getitem__(self, i):
+        if isinstance(self.grid, Sequence):
+            return self.grid[i]
+        if self._values is None:  # E.g., a set, a dict or an array, listed once
+            self._values = list(self.iter_values())
+        return self._values[i]
+
     def __len__(self):
         return len(self.grid)
 
 
+class _MonotonicGridVariable(GridVariable):
+    """A grid variable whose values are sorted, computed from their position instead of being stored"""
+
+    def get_standard(self):
+        if self.standard is not None:
+            return self.standard
+        # Same element as the generic method, without sorting
+        length = len(self.grid)
+        if length > 1 and self.grid[-1] < self.grid[0]:
+            return self.grid[length - 1 - length // 2]
+        return self.grid[length // 2]
+
+    def index_of(self, value):
+        return self.grid.index(value)
+
+
+class RangeVariable(_MonotonicGridVariable):
+    """A variable whose values are the integers of a range"""
+
+    def __init__(self, name, start, stop=None, step=1, standard=None):
+        """
+
+        Args:
+            name (str): Name of the variable.
+            start (int): First value, or the stop if that is not given (then starting at 0).
+            stop (int): The value at which the range stops (not included).
+            step (int): Difference between consecutive values.
+            standard (int): The "default" value (see Experiment's mid_point). If None, the median is used.
+
+        """
+        if stop is None:
+            start, stop = 0, start
+        super().__init__(name, range(start, stop, step), standard=standard)
+
+
+class _LinearSpace(Sequence):
+    """Lazy sequence of evenly spaced floats, including both endpoints"""
+
+    def __init__(self, start, stop, num):
+        self.start = start
+        self.stop = stop
+        self.num = num
+        self._step = (stop - start) / (num - 1) if num > 1 else 0.0
+
+    def _value(self, i):
+        if i == self.num - 1 and self.num > 1:  # Exactly the stop, as numpy (a single value is the start)
+            return float(self.stop)
+        return float(self.start + i * self._step)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.num))]
+        if i < 0:
+            i += self.num
+        if not 0 <= i < self.num:
+            raise IndexError("Index out of range")
+        return self._value(i)
+
+    def __len__(self):
+        return self.num
+
+    def _guess_index(self, value):
+        return (value - self.start) / self._step if self._step else 0
+
+    def index(self, value, *args):
+        guess = self._guess_index(value)
+        # Rounding might be off by one
+        for i in [round(guess), math.floor(guess), math.ceil(guess)]:
+            if 0 <= i < self.num and self._value(i) == value:
+                return i
+        raise ValueError("%r is not in the sequence" % value)
+
+
+class _LogarithmicSpace(_LinearSpace):
+    """Lazy sequence of floats evenly spaced in a logarithmic scale, including both endpoints"""
+
+    def __init__(self, start, stop, num, base):
+        super().__init__(start, stop, num)
+        self.base = base
+
+    def _value(self, i):
+        return float(self.base ** super()._value(i))
+
+    def _guess_index(self, value):
+        return super()._guess_index(math.log(value, self.base)) if value > 0 else -1
+
+
+class LinSpaceVariable(_MonotonicGridVariable):
+    """A variable whose values are evenly spaced floats, as given by numpy.linspace, but not stored"""
+
+    def __init__(self, name, start, stop, num, standard=None):
+        """
+
+        Args:
+            name (str): Name of the variable.
+            start (float): First value.
+            stop (float): Last value.
+            num (int): Number of values.
+            standard (float): The "default" value (see Experiment's mid_point). If None, the median is used.
+
+        """
+        super().__init__(name, _LinearSpace(start, stop, num), standard=standard)
+
+
+class LogSpaceVariable(_MonotonicGridVariable):
+    """A variable whose values are evenly spaced in a logarithmic scale, as given by numpy.logspace, but not stored"""
+
+    def __init__(self, name, start, stop, num, base=10.0, standard=None):
+        """
+
+        Args:
+            name (str): Name of the variable.
+            start (float): Exponent of the first value.
+            stop (float): Exponent of the last value.
+            num (int): Number of values.
+            base (float): Base of the exponents.
+            standard (float): The "default" value (see Experiment's mid_point). If None, the median is used.
+
+        """
+        super().__init__(name, _LogarithmicSpace(start, stop, num, base), standard=standard)
+
+
+def _iter_indices(lengths):
+    """Iterate the tuples of indices of a grid in lexicographic order, without materializing its axes"""
+    if any(length == 0 for length in lengths):
+        return
+    indices = [0] * len(lengths)
+    while True:
+        yield tuple(indices)
+        for axis in reversed(range(len(lengths))):
+            indices[axis] += 1
+            if indices[axis] < lengths[axis]:
+                break
+            indices[axis] = 0
+        else:
+            return
+
+
+# Number of completed trials, closest first, tried to find a warm start which did not fail
+_WARM_START_CANDIDATES = 4
+
+# Number of completed trials, closest first, used to estimate the peak of memory or the duration of a trial
+_ESTIMATE_NEIGHBORS = 2
+
+# Contexts built by the setup of the experiments, by (experiment key, process id, thread id)
+_contexts = {}
+_contexts_lock = threading.Lock()
+
+
+def _init_pool_worker(experiment, inner_threads=None):
+    """Initializer of the pool processes, limiting their native threads and cleaning up on exit"""
+    if inner_threads is not None:
+        limit_inner_threads(inner_threads)
+    Finalize(None, experiment._teardown_contexts, exitpriority=10)
+    Finalize(None, experiment._flush_results, exitpriority=10)
+
+
+def _until_set(tasks, event):
+    """Iterate the tasks until the event is set"""
+    for task in tasks:
+        if event.is_set():
+            return
+        yield task
+
+
 def implicit_variable_cast(variable):
     if isinstance(variable, Variable):
         return variable
@@ -161,7 +682,9 @@ def implicit_variable_cast(variable):
 class Experiment:
     """An experiment"""
 
-    def __init__(self, variables, f, store, base_name=None, add_stats=True, strategy="grid", mid_point=None):
+    def __init__(self, variables, f, store, base_name=None, add_stats=True, strategy="grid", mid_point=None,
+                 setup=None, teardown=None, context_arg="context", checkpoint_arg=None, warm_start_arg=None,
+                 fingerprint=False, version=None, write_behind=False, storage="disk", max_memory=None):
         """
 
         Args:
@@ -179,6 +702,35 @@ class Experiment:
                                       be defined with the mid_point parameter.
             mid_point (dict of str): A mapping of parameters to their "default" values. Used if strategy is "star". The
                                      mid_point must be in the grid.
+            setup (callable): A function without arguments building a context (e.g., loading a large table) which is
+                              passed to f as the context_arg argument. It is built once per worker (process or thread)
+                              and it is not part of the hash of the trials.
+            teardown (callable): A function called with the context when a worker finishes using it.
+            context_arg (str): Name of the argument of f receiving the context, if setup is given.
+            checkpoint_arg (str): Name of an argument of f receiving a Checkpoint, whose save and load methods allow to
+                                  store and restore the partial state of the trial. Interrupted trials are resumed from
+                                  it when run again. If None, no checkpoint is used.
+            warm_start_arg (str): Name of an argument of f receiving the result of the nearest completed trial (in the
+                                  space of grid indices), or None if there is none, e.g., to use it as an initial guess.
+                                  It is not part of the hash of the trials. If None, no warm start is given.
+            fingerprint (bool): Whether to store a fingerprint of f (see function_fingerprint) with the results, which
+                                requires add_stats. Results of older implementations can then be removed with
+                                invalidate(stale_only=True).
+            version (str): A version of f, included in the fingerprint. Setting it also enables the fingerprint, so it
+                           requires add_stats too.
+            write_behind (bool): Whether to collect the results in memory, storing them in batches from a background
+                                 thread of each process (see BatchWriter), which takes the writing out of very short
+                                 trials, although each result still gets its own file. They are flushed when runs
+                                 finish or the process exits (see flush_on_signals for termination signals), but those
+                                 of a process which is killed (e.g., after a timeout) are lost and run again later.
+            storage (str): Where the results are kept. Available options are:
+                           - "disk": In a file per trial in the store.
+                           - "memory": In memory, only writing them to their files (the least recently used ones
+                                       first) when exceeding max_memory, or when calling persist. Results are not
+                                       shared with other processes, so trials cannot be run in them. Checkpoints and
+                                       the index of errored trials are kept in memory too.
+            max_memory (int): Maximum size in bytes of the (pickled) results kept in memory if storage is "memory". If
+                              None, they are kept until persisted.
 
         """
         self.variables = [implicit_variable_cast(v) for v in variables]
@@ -190,6 +742,20 @@ class Experiment:
 
         self.strategy = strategy
 
+        self.setup = setup
+        self.teardown = teardown
+        self.context_arg = context_arg
+        self.checkpoint_arg = checkpoint_arg
+        self.warm_start_arg = warm_start_arg
+        self.write_behind = write_behind
+        if storage not in ["disk", "memory"]:
+            raise ValueError("Invalid storage. Available options are: 'disk', 'memory'.")
+        self.storage = storage
+        self._memory = MemoryStore(max_memory) if storage == "memory" else None
+        if (fingerprint or version is not None) and not add_stats:
+            raise ValueError("The fingerprint is stored with the running information, so it requires add_stats")
+        self._fingerprint = function_fingerprint(f, version) if fingerprint or version is not None else None
+
         if strategy in ["grid", "urinal"]:
             self._len = prod(len(v) for v in self.variables)
         elif strategy == "star":
@@ -213,8 +779,13 @@ class Experiment:
         """Iterate all combinations of kwargs"""
         names = [v.name for v in self.variables]
         if self.strategy == "grid":
-            for t in product(*(v.iter_values() for v in self.variables)):
-                yield dict(zip(names, t))
+            if all(isinstance(v, GridVariable) for v in self.variables):
+                # Random access, so lazy variables are not materialized
+                for indices in _iter_indices([len(v) for v in self.variables]):
+                    yield {v.name: v[i] for v, i in zip(self.variables, indices)}
+            else:
+                for t in product(*(v.iter_values() for v in self.variables)):
+                    yield dict(zip(names, t))
         elif self.strategy == "star":
             mid_point = self.mid_point if self.mid_point is not None else {}
             yield mid_point
@@ -224,40 +795,494 @@ class Experiment:
                         yield {**mid_point, **{v.name: value}}
         elif self.strategy == "urinal":
             from .urinal import urinal_iteration
-            items = [list(v.iter_values()) for v in self.variables]
-
-            for indices in urinal_iteration([len(l) for l in items]):
-                yield {name: values[i] for name, values, i in zip(names, items, indices)}
-
 
+            # Random access to grid variables, so lazy ones are not materialized
+            axes = [v if isinstance(v, GridVariable) else list(v.iter_values()) for v in self.variables]
+            for indices in urinal_iteration([len(v) for v in self.variables]):
+                yield {v.name: axis[i] for v, axis, i in zip(self.variables, axes, indices)}
         else:
             raise ValueError("Invalid value for parameter strategy.")
 
-    def _run_kwargs(self, **kwargs):
-        """Helper pickleable function"""
+    def _trial(self, kwargs, extra_kwargs=None):
+        """Get the trial of the experiment with the given kwargs"""
+        return Trial(kwargs, self.f, self.store, base_name=self.base_name, extra_kwargs=extra_kwargs,
+                     checkpoint_arg=self.checkpoint_arg, fingerprint=self._fingerprint,
+                     writer=self._memory if self._memory is not None else get_writer() if self.write_behind else None)
+
+    def _key(self):
+        """Identifier of the experiment, preserved when pickled"""
+        return os.path.abspath(self.store), self.base_name if self.base_name is not None else self.f.__name__
+
+    def _context_key(self):
+        """Key of the context of the current worker (process and thread)"""
+        return self._key(), os.getpid(), threading.get_ident()
+
+    def _has_context(self):
+        """Check if the context of the current worker (process and thread) is built"""
+        with _contexts_lock:
+            return self._context_key() in _contexts
+
+    def _get_context(self):
+        """Get the context of the current worker (process and thread), building it if needed"""
+        key = self._context_key()
+        with _contexts_lock:
+            if key in _contexts:
+                return _contexts[key]
+        context = self.setup()
+        with _contexts_lock:
+            _contexts[key] = context
+        return context
+
+    def _teardown_context(self):
+        """Tear down the context of the current worker (process and thread), if built"""
+        with _contexts_lock:
+            if self._context_key() not in _contexts:
+                return
+            context = _contexts.pop(self._context_key())
+        if self.teardown is not None:
+            self.teardown(context)
+
+    def _teardown_contexts(self):
+        """Tear down the contexts built by any thread of the current process"""
+        pid = os.getpid()
+        with _contexts_lock:
+            keys = [k for k in _contexts if k[0] == self._key() and k[1] == pid]
+            contexts = [_contexts.pop(k) for k in keys]
+        if self.teardown is not None:
+            for context in contexts:
+                self.teardown(context)
+
+    def persist(self):
+        """Write the results kept in memory (if storage is "memory") to their files in the store"""
+        if self._memory is not None:
+            self._memory.flush()
+
+    def _flush_results(self):
+        """Store the results collected by the writer of the current process, if writing behind"""
+        if self.write_behind:
+            get_writer().flush()
+
+    def _runtime_kwargs(self, warm_start=None):
+        """Arguments for f which are not part of the hash of the trials"""
+        extra_kwargs = {}
+        if self.setup is not None:
+            extra_kwargs[self.context_arg] = self._get_context()
+        if self.warm_start_arg is not None:
+            extra_kwargs[self.warm_start_arg] = self._load_warm_start(warm_start if warm_start is not None else [])
+        return extra_kwargs
+
+    def _load_warm_start(self, candidates):
+        """Load the result of the first candidate trial (given by its kwargs) which did not fail"""
+        for kwargs in candidates:
+            try:
+                result = self._trial(kwargs).load()
+            except FileNotFoundError:
+                continue
+            if not (isinstance(result, dict) and "_error" in result):
+                return result
+        return None
+
+    def _grid_point(self, kwargs):
+        """Get the coordinates of a trial in the space of grid indices"""
+        return tuple(v.index_of(kwargs[v.name]) for v in self.variables)
+
+    def _warm_start_index(self):
+        """Build an index of the available trials, used to find the nearest one to warm-start a trial"""
+        from .neighbors import NeighborIndex
+
+        index = NeighborIndex()
+        for kwargs in self.iter_values():
+            if self._trial(kwargs).is_available():
+                index.add(self._grid_point(kwargs), kwargs)
+        return index
+
+    def _iter_tasks(self, warm_index=None):
+        """
+        Iterate the trials to run as (kwargs, options) pairs, where options are the arguments of _run_trial.
+
+        Warm starts are looked up when each task is requested, so they include the trials completed up to then.
+        """
+        for kwargs in self.iter_values():
+            if warm_index is None:
+                yield kwargs, {}
+            else:
+                yield kwargs, {"warm_start": warm_index.nearest(self._grid_point(kwargs), k=_WARM_START_CANDIDATES)}
+
+    def _errored_trials(self):
+        """Get the kwargs and the number of failed attempts of the trials in the index of errored trials"""
+        errored = []
+        prefix = self.base_name if self.base_name is not None else self.f.__name__
+        paths = glob(os.path.join(self.store, "%s-*.err" % glob_escape(prefix)))
+        if self._memory is not None:
+            pattern = os.path.join(glob_escape(self.store), "%s-*.err" % glob_escape(prefix))
+            paths = list(dict.fromkeys(paths + [path for path in self._memory.paths() if fnmatchcase(path, pattern)]))
+        for path in paths:
+            record = _ErrorRecord(path, memory=self._memory).load()
+            # Skip records of other experiments whose name starts with the same prefix
+            if record is not None and self._trial(record["kwargs"]).get_file_name(".err") == os.path.basename(path):
+                errored.append((record["kwargs"], record["attempts"]))
+        return errored
+
+    def _retry_tasks(self, max_retries=1, backoff=0.0, warm_index=None):
+        """Get the errored trials which can be retried now as (kwargs, options) pairs, a snapshot of the index"""
+        tasks = []
+        for kwargs, attempts in self._errored_trials():
+            if max_retries is not None and attempts > max_retries:
+                continue
+            options = {"retry_backoff": backoff}
+            if warm_index is not None:
+                options["warm_start"] = warm_index.nearest(self._grid_point(kwargs), k=_WARM_START_CANDIDATES)
+            tasks.append((kwargs, options))
+        return tasks
+
+    def _remove_tmp_files(self, pid):
+        """Remove the temporary files left in the store by a process killed while writing them (e.g., its result)"""
+        for path in glob(os.path.join(glob_escape(self.store), "*.%d.tmp" % pid)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _stat_index(self, stat):
+        """Build an index of a statistic recorded by the available trials (e.g., "_peak_rss") to estimate others"""
+        from .neighbors import NeighborIndex
+
+        index = NeighborIndex()
+        for kwargs, result in self.iter_results():
+            if isinstance(result, dict) and result.get(stat) is not None:
+                index.add(self._grid_point(kwargs), result[stat])
+        return index
+
+    def _estimate_memory(self, index, kwargs):
+        """Estimate the peak of memory of a trial as the largest of its nearest trials in the index, if any"""
+        if not len(index):
+            return None
+        return max(index.nearest(self._grid_point(kwargs), k=_ESTIMATE_NEIGHBORS))
+
+    def _task_memory(self, estimator, kwargs):
+        """Estimate the memory needed to run a trial with the estimator, or none if it is available (it is skipped)"""
+        if self._trial(kwargs).is_available():
+            return 0
+        return estimator(kwargs)
+
+    def _estimate_duration(self, index, kwargs):
+        """Estimate the duration of a trial as the mean of its nearest trials in the index, if any"""
+        if not len(index):
+            return None
+        durations = index.nearest(self._grid_point(kwargs), k=_ESTIMATE_NEIGHBORS)
+        return sum(durations) / len(durations)
+
+    def _describe_kwargs(self, kwargs):
+        return ", ".join("%s = %s" % (str(a), str(b)) for a, b in kwargs.items())
+
+    def _run_trial(self, kwargs, warm_start=None, retry_backoff=None, record_memory=False, inputs=None, flush=False):
+        """
+        Run a trial if not available
+
+        Args:
+            kwargs (dict): The kwargs of the trial.
+            warm_start (list of dict): The kwargs of the candidate trials to warm-start this one, closest first.
+            retry_backoff (float): If not None, the trial is retried if it is in the index of errored trials, waiting
+                                   until retry_backoff * 2 ** (attempts - 1) seconds have passed since its last error.
+            record_memory (bool): Whether to record the peak of memory of the trial (see Trial.run_and_save).
+            inputs (dict): A mapping of names of arguments of f to trials (of other experiments) whose results they
+                           receive. If any of them stored an error, or is not available, an error is stored for this
+                           trial.
+            flush (bool): Whether to store the results collected by the writer of the process once the trial finishes
+                          (if writing behind), so other processes can read them (e.g., trials using it as an input).
+
+        Returns:
+            float: The seconds spent running the trial, or None if it was already available.
+
+        """
+        trial = self._trial(kwargs)
+        if retry_backoff is None:
+            if trial.is_available():
+                return None
+        else:
+            record = trial.get_error_record().load()
+            if record is None:  # Already retried successfully
+                return None
+            time.sleep(max(0.0, record["time"] + retry_backoff * 2 ** (record["attempts"] - 1) - time.time()))
+        start = time.monotonic()
         try:
-            Trial(kwargs, self.f, self.store, base_name=self.base_name).load_or_run(add_stats=self.add_stats)
+            trial.extra_kwargs = self._runtime_kwargs(warm_start)
+            if inputs:
+                results = {}
+                for arg, input_trial in inputs.items():
+                    try:
+                        results[arg] = input_trial.load()
+                    except FileNotFoundError:
+                        self._record_failure(kwargs, time.monotonic() - start,
+                                             "Input trial not available (%s): %s" % (arg, input_trial.get_file_name()))
+                        return time.monotonic() - start
+                failed = [arg for arg, result in results.items() if isinstance(result, dict) and "_error" in result]
+                if failed:
+                    self._record_failure(kwargs, time.monotonic() - start,
+                                         "Input trial failed (%s):\n%s" % (failed[0], results[failed[0]]["_error"]))
+                    return time.monotonic() - start
+                trial.extra_kwargs.update(results)
+            trial.run_and_save(add_stats=self.add_stats, record_memory=record_memory)
         except Exception:
-            print("Skipping failed run with parameters %s\n" % ", ".join(
-                "%s = %s" % (str(a), str(b)) for a, b in kwargs.items()))
+            print("Skipping failed run with parameters %s\n" % self._describe_kwargs(kwargs))
+        finally:
+            if flush:
+                self._flush_results()
+        return time.monotonic() - start
 
-    def run_all(self, method="sequential", threads=2):
-        """Run all trials. If already run, kept."""
+    def _run_kwargs(self, **kwargs):
+        """Helper pickleable function, returning the seconds spent running the trial (None if already available)"""
+        return self._run_trial(kwargs)
+
+    def _record_failure(self, kwargs, elapsed, message):
+        """Store an error which prevented a trial from finishing (e.g., a timeout)"""
+        if not self.add_stats:
+            print("Skipping failed run with parameters %s\n" % self._describe_kwargs(kwargs))
+            return
+        start = datetime.now() - timedelta(seconds=elapsed)
+        trial = self._trial(kwargs)
+        attempts = trial.get_attempts()
+        trial.save({**trial.get_stats(start, elapsed, attempts), "_error": message})
+        trial.record_error(attempts)
+
+    def _iter_sequential(self, tasks, deadline=None):
+        """Run the tasks in the current process, yielding pairs of kwargs and seconds spent"""
+        durations = []
+        for kwargs, options in tasks:
+            if exceeds_deadline(deadline, durations):
+                break
+            spent = self._run_trial(kwargs, **options)
+            if spent is not None:
+                durations.append(spent)
+            yield kwargs, spent
+
+    def _iter_threaded(self, tasks, threads, deadline=None):
+        """Run the tasks in a pool of threads, yielding pairs of kwargs and seconds spent"""
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+        durations = []
+        running = {}
+        exhausted = False
+        with ThreadPoolExecutor(threads) as executor:
+            while True:
+                while not exhausted and len(running) < threads:
+                    task = None if exceeds_deadline(deadline, durations) else next(tasks, None)
+                    if task is None:
+                        exhausted = True
+                    else:
+                        kwargs, options = task
+                        running[executor.submit(self._run_trial, kwargs, **options)] = kwargs
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    spent = future.result()
+                    if spent is not None:
+                        durations.append(spent)
+                    yield running.pop(future), spent
+
+    def _iter_processes(self, tasks, processes, deadline=None, cancel_event=None, **kwargs):
+        """Run the tasks in a ProcessExecutor, yielding pairs of kwargs and seconds spent"""
+        from .executor import ProcessExecutor
+
+        executor = ProcessExecutor([self], processes, **kwargs)
+        with closing(executor.run(((0, kwargs, options) for kwargs, options in tasks), deadline=deadline,
+                                  cancel_event=cancel_event)) as runner:
+            for task, spent in runner:
+                yield task[1], spent
+
+    def _iter_pool(self, tasks, threads, inner_threads=None, cancel_event=None):
+        """
+        Run the tasks in a multiprocessing pool, yielding pairs of kwargs and seconds spent
+
+        If the cancel event is set, the pool is terminated, killing the running trials and dropping the pending ones.
+        """
+        from .executor import _CANCEL_POLL_SECONDS
+
+        with Pool(threads, initializer=_init_pool_worker, initargs=(self, inner_threads)) as pool:
+            results = [(kwargs, pool.apply_async(self._run_trial, (kwargs,), options)) for kwargs, options in tasks]
+            for kwargs, result in results:
+                if cancel_event is not None:
+                    while not result.ready():
+                        if cancel_event.is_set():
+                            return  # Terminating the pool when exiting the context
+                        result.wait(_CANCEL_POLL_SECONDS)
+                yield kwargs, result.get()
+            # Let the workers exit normally, tearing down their contexts
+            pool.close()
+            pool.join()
+
+    def run_all(self, method="sequential", threads=2, timeout=None, time_budget=None, retry_errors=False,
+                max_retries=1, backoff=0.0, inner_threads=None, memory_limit=None, memory_estimator=None,
+                memory_default=None, speculate=None, background=False):
+        """
+        Run all trials. If already run, kept.
+
+        If the experiment has a setup, each worker (the current process if sequential, each thread or process
+        otherwise) builds its context once, tearing it down when the run finishes.
+
+        If the experiment has a warm_start_arg, each trial receives the result of the nearest trial completed when it
+        is started.
+
+        Args:
+            method (str): How to run the trials. Available options are:
+                          - "sequential": One after another in the current process.
+                          - "threading": In parallel, using a pool of threads.
+                          - "multithreading": In parallel, using a pool of processes.
+            threads (int): Number of threads or processes to use if running in parallel.
+            timeout (float): Maximum number of seconds a trial can run. If set, trials are run in worker processes
+                             which are killed and replaced when exceeded, storing the timeout as an error. Not
+                             available with the "threading" method.
+            time_budget (float): Number of seconds available for the whole run. No new trials are started when the
+                                 mean duration of the trials run so far would exceed it, but the running ones are
+                                 finished.
+            retry_errors (bool): Whether to run only the trials in the index of errored trials, retrying them until
+                                 they succeed or reach max_retries. Those failing again are retried in a new pass once
+                                 all the trials of the current one have finished. Successful trials are not accessed.
+            max_retries (int): Maximum number of retries of an errored trial, counting those of previous runs. None for
+                               no limit.
+            backoff (float): Seconds to wait after an error before the first retry, doubled in each subsequent one.
+            inner_threads (int or str): Number of threads of the native thread pools (BLAS, OpenMP...) used by each
+                                        process or thread running trials, recorded as "_inner_threads" in the running
+                                        information. "auto" splits the available CPUs between the processes or threads
+                                        (or uses all of them if running sequentially). None not to limit them.
+            memory_limit (int): Maximum number of bytes the processes running trials are estimated to use at the same
+                                time with the "multithreading" method. Trials are started only while the estimated
+                                total fits (or if no other is running), possibly overtaking larger ones.
+            memory_estimator (callable): A function mapping the kwargs of a trial to its estimated peak of memory in
+                                         bytes, or None if unknown. If None, trials record their peak ("_peak_rss")
+                                         and the estimate is the largest peak recorded by the nearest completed
+                                         trials, so it is learnt from the first trials to finish. Available trials are
+                                         not estimated, since they are skipped.
+            memory_default (int): Estimated peak of memory in bytes of the trials without an estimate (e.g., before any
+                                  trial has recorded its peak). If None, they are assumed to need the whole
+                                  memory_limit, so they only start when no other trial is running.
+            speculate (float): If given, with the "multithreading" method, idle processes run copies of trials which
+                               have been running more than speculate times their expected duration (the mean
+                               "_elapsed_seconds" of the nearest completed trials) once no other trial can be started.
+                               The first copy to finish is kept and the others are killed.
+            background (bool): Whether to run in a background thread, returning immediately. The progress bar is
+                               replaced by the returned handle.
+
+        Returns:
+            RunHandle: A handle to the run if in background, otherwise None.
+
+        """
         method = method.lower()
-        if method == "sequential":
-            for kwargs in tqdm(self.iter_values(), total=len(self)):
-                try:
-                    Trial(kwargs, self.f, self.store, base_name=self.base_name).load_or_run(add_stats=self.add_stats)
-                except Exception:
-                    print("Skipping failed run with parameters %s\n" % ", ".join(
-                        "%s = %s" % (str(a), str(b)) for a, b in kwargs.items()))
-        elif method == "multithreading":
-            with Pool(threads) as pool:
-                results = [pool.apply_async(self._run_kwargs, kwds=kwargs) for kwargs in self.iter_values()]
-                for result in tqdm(results, total=len(self)):
-                    result.get()
-        else:
+        if method not in ["sequential", "threading", "multithreading"]:
             raise ValueError("Invalid method")
+        if method == "threading" and timeout is not None:
+            raise ValueError("Threads cannot be stopped, so timeout requires a process-based method")
+        if method == "threading" and memory_limit is not None:
+            raise ValueError("Threads share their memory, so memory_limit requires a process-based method")
+        if method != "multithreading" and speculate is not None:
+            raise ValueError("speculate requires the multithreading method")
+        if self._memory is not None and (method == "multithreading" or timeout is not None):
+            raise ValueError("Results kept in memory are not shared with other processes, so use a thread-based method")
+        options = dict(method=method, threads=threads, timeout=timeout, time_budget=time_budget,
+                       retry_errors=retry_errors, max_retries=max_retries, backoff=backoff,
+                       inner_threads=inner_threads, memory_limit=memory_limit, memory_estimator=memory_estimator,
+                       memory_default=memory_default, speculate=speculate)
+        if not background:
+            self._run_all(**options)
+            return None
+
+        handle = RunHandle(self, None if retry_errors else len(self))
+        handle._start(functools.partial(self._run_all, handle=handle, **options))
+        return handle
+
+    def _run_all(self, method, threads, timeout, time_budget, retry_errors, max_retries, backoff, inner_threads,
+                 memory_limit, memory_estimator, memory_default, speculate, handle=None):
+        """Run the trials as described in run_all, reporting the progress to the handle if given"""
+        deadline = time.monotonic() + time_budget if time_budget is not None else None
+
+        warm_index = self._warm_start_index() if self.warm_start_arg is not None else None
+
+        memory_index = None
+        if memory_limit is not None:
+            if memory_estimator is None:
+                memory_index = self._stat_index("_peak_rss")
+                memory_estimator = functools.partial(self._estimate_memory, memory_index)
+            memory_estimator = functools.partial(self._task_memory, memory_estimator)
+
+        duration_index = None
+        duration_estimator = None
+        if speculate is not None:
+            duration_index = self._stat_index("_elapsed_seconds")
+            duration_estimator = functools.partial(self._estimate_duration, duration_index)
+
+        processes = threads if method == "multithreading" else 1
+        # Threads run their trials at the same time too, so they split the CPUs as processes do
+        inner_threads = resolve_inner_threads(inner_threads, 1 if method == "sequential" else threads)
+        # Tasks dispatched on demand to processes which can be killed
+        on_demand = timeout is not None or (method == "multithreading" and (
+                deadline is not None or warm_index is not None or memory_limit is not None or speculate is not None))
+        restore_threads = None
+        if method != "multithreading" and not on_demand and inner_threads is not None:
+            # Threads share the limits of the current process, restored after the run
+            restore_threads = limit_inner_threads(inner_threads)
+
+        cancel_event = handle._cancel_event if handle is not None else None
+
+        def run_tasks(tasks, total):
+            """Run some tasks, returning the number of trials run"""
+            if memory_index is not None:
+                tasks = ((kwargs, {**options, "record_memory": True}) for kwargs, options in tasks)
+            if cancel_event is not None:
+                # Checked before starting each trial
+                tasks = _until_set(tasks, cancel_event)
+            if on_demand:
+                runner = self._iter_processes(tasks, processes, deadline=deadline, cancel_event=cancel_event,
+                                              timeout=timeout, inner_threads=inner_threads,
+                                              memory_limit=memory_limit, memory_estimator=memory_estimator,
+                                              memory_default=memory_default, speculate=speculate,
+                                              duration_estimator=duration_estimator)
+            elif method == "multithreading":
+                runner = self._iter_pool(tasks, threads, inner_threads=inner_threads, cancel_event=cancel_event)
+            elif method == "sequential":
+                runner = self._iter_sequential(tasks, deadline=deadline)
+            else:
+                runner = self._iter_threaded(tasks, threads, deadline=deadline)
+
+            ran = 0
+            # Closing the runner if interrupted (e.g., cancelled) finishes or kills the running trials
+            with closing(runner):
+                for kwargs, spent in (runner if handle is not None else tqdm(runner, total=total)):
+                    if handle is not None:
+                        handle._update(spent)
+                        if handle.cancelled:
+                            break
+                    if spent is None:
+                        continue
+                    ran += 1
+                    if warm_index is not None:
+                        warm_index.add(self._grid_point(kwargs), kwargs)
+                    if duration_index is not None:
+                        duration_index.add(self._grid_point(kwargs), spent)
+                    if memory_index is not None:
+                        try:
+                            result = self._trial(kwargs).load()
+                        except FileNotFoundError:  # Not written yet by the worker
+                            continue
+                        if isinstance(result, dict) and result.get("_peak_rss") is not None:
+                            memory_index.add(self._grid_point(kwargs), result["_peak_rss"])
+            return ran
+
+        try:
+            if not retry_errors:
+                run_tasks(self._iter_tasks(warm_index), len(self))
+            else:
+                # Each pass retries a snapshot of the index, so no trial is retried again while still running. Those
+                # failing again are found when scanning the index after the pass has finished.
+                while handle is None or not handle.cancelled:
+                    tasks = self._retry_tasks(max_retries, backoff, warm_index)
+                    if not tasks or not run_tasks(iter(tasks), len(tasks)):  # Nothing left, or no time left
+                        break
+        finally:
+            self._teardown_contexts()
+            self._flush_results()
+            if restore_threads is not None:
+                restore_threads()
 
     def iter_results(self, skip_errors=True):
         """Iterate pairs of kwargs, results
@@ -274,7 +1299,7 @@ class Experiment:
         """
         for kwargs in self.iter_values():
             try:
-                result = Trial(kwargs, self.f, self.store, base_name=self.base_name).load()
+                result = self._trial(kwargs).load()
                 if skip_errors and isinstance(result, dict) and "_error" in result:
                     continue
                 yield kwargs, result
@@ -283,7 +1308,19 @@ class Experiment:
 
     def get_result(self, kwargs):
         """Get the result of a certain configuration, running it if not available"""
-        return Trial(kwargs, self.f, self.store, base_name=self.base_name).load_or_run(add_stats=self.add_stats)
+        trial = self._trial(kwargs)
+        try:
+            return trial.load()
+        except FileNotFoundError:
+            pass
+        # Only the context built here, others may be in use by running trials
+        built = not self._has_context()
+        try:
+            trial.extra_kwargs = self._runtime_kwargs()
+            return trial.run_and_save(add_stats=self.add_stats)
+        finally:
+            if built:
+                self._teardown_context()
 
     def status(self):
         """
@@ -302,7 +1339,7 @@ class Experiment:
         for kwargs in self.iter_values():
             total += 1
             try:
-                result = Trial(kwargs, self.f, self.store, base_name=self.base_name).load()
+                result = self._trial(kwargs).load()
                 count += 1
                 if isinstance(result, dict) and "_error" in result:
                     errors += 1
@@ -311,53 +1348,219 @@ class Experiment:
 
         return {"total": total, "done": count, "errors": errors}
 
-    def get_results_df(self, skip_errors=True):
+    def _iter_rows(self, skip_errors=True):
+        """Iterate the available results as flat rows including the kwargs"""
+        for kwargs, result in self.iter_results(skip_errors=skip_errors):
+            if isinstance(result, dict):
+                # TODO: Ensure no overlapping
+                yield {**kwargs, **result}
+            else:
+                if "result" in kwargs:
+                    raise ValueError("Conflicting name result in kwarg")
+                yield {**kwargs, "result": result}
+
+    def _results_frame(self, rows, categorical=False, parse_dates=False, float32=False, schema=None):
+        """Build a dataframe from an iterable of rows, filling it column by column"""
+        try:
+            import pandas as pd
+        except ImportError:
+            raise ModuleNotFoundError("The pandas package is required")
+
+        names = [v.name for v in self.variables]
+        columns = {name: [] for name in names}
+        n = 0
+        for row in rows:
+            for key, value in row.items():
+                column = columns.get(key)
+                if column is None:
+                    column = columns[key] = [float("nan")] * n
+                column.append(value)
+            n += 1
+            if len(row) < len(columns):  # Some columns missing in this row
+                for column in columns.values():
+                    if len(column) < n:
+                        column.append(float("nan"))
+
+        df = pd.DataFrame(columns)
+        if categorical:
+            for v in self.variables:
+                # Categories in the order of the grid, which also keeps those not available yet
+                categories = list(dict.fromkeys(v.iter_values()))
+                df[v.name] = pd.Categorical(df[v.name], categories=categories)
+        if parse_dates and "_run_start" in df:
+            try:
+                df["_run_start"] = pd.to_datetime(df["_run_start"], format="ISO8601")
+            except (TypeError, ValueError):  # Older pandas versions
+                df["_run_start"] = pd.to_datetime(df["_run_start"])
+        if float32:
+            for name in df.columns:
+                if name not in names and df[name].dtype == "float64":
+                    df[name] = df[name].astype("float32")
+        if schema is not None:
+            for name, dtype in schema.items():
+                df[name] = df[name].astype(dtype) if name in df else pd.Series(index=df.index, dtype=dtype)
+        return df.set_index(names)
+
+    def get_results_df(self, skip_errors=True, categorical=False, parse_dates=False, float32=False, schema=None):
         """
         Get a dataframe with the available results
 
         Args:
             skip_errors (bool): Whether to ignore errors. If false, an "_error" column with the trace will be available
+            categorical (bool): Whether the levels of the index are categorical, with the values of the variables as
+                                categories.
+            parse_dates (bool): Whether to convert the _run_start column to datetimes.
+            float32 (bool): Whether to downcast the float results to float32.
+            schema (dict): A mapping of results to their dtypes. Missing results are added as empty columns.
 
         Returns:
             pd.DataFrame: The dataframe with the results.
 
         """
-        if pd is None:
-            raise ModuleNotFoundError("The pandas package is required")
+        return self._results_frame(self._iter_rows(skip_errors=skip_errors), categorical=categorical,
+                                   parse_dates=parse_dates, float32=float32, schema=schema)
 
-        results = []
-        for kwargs, result in self.iter_results(skip_errors=skip_errors):
-            if isinstance(result, dict):
-                # TODO: Ensure no overlapping
-                results.append({**kwargs, **result})
-            else:
-                if "result" in kwargs:
-                    raise ValueError("Conflicting name result in kwarg")
-                results.append({**kwargs, "result": result})
+    def iter_results_df(self, chunk_size=10000, skip_errors=True, **kwargs):
+        """
+        Iterate the available results as dataframes with a bounded number of rows
+
+        Args:
+            chunk_size (int): Maximum number of rows of each dataframe.
+            skip_errors (bool): Whether to ignore errors. If false, an "_error" column with the trace will be available
+            **kwargs: Additional arguments defining the types of the dataframes, as in get_results_df.
+
+        Yields:
+            pd.DataFrame: Dataframes with the results, as those of get_results_df.
+
+        """
+        rows = self._iter_rows(skip_errors=skip_errors)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            yield self._results_frame(chunk, **kwargs)
+
+    def _accumulate(self, group_by, columns=None, shard=0, n_shards=1):
+        """
+        Stream through a shard of the trials, accumulating running statistics of the results by group
+
+        Returns:
+            dict: A mapping of group keys (tuples) to mappings of column names to RunningStats.
+
+        """
+        accumulators = {}
+        for i, kwargs in enumerate(self.iter_values()):
+            if i % n_shards != shard:
+                continue
+            try:
+                result = self._trial(kwargs).load()
+            except FileNotFoundError:  # Not available
+                continue
+            if not isinstance(result, dict):
+                result = {"result": result}
+            elif "_error" in result:
+                continue
+            row = {**kwargs, **result}
+            group = accumulators.setdefault(tuple(row.get(name) for name in group_by), {})
+            for column, value in (result.items() if columns is None else ((c, row.get(c)) for c in columns)):
+                if column in group_by or not isinstance(value, numbers.Real) or value != value:  # Skip nan
+                    continue
+                group.setdefault(column, RunningStats()).add(value)
+        return accumulators
+
+    def aggregate(self, group_by, columns=None, stats=("mean", "sem", "min", "max", "count"), processes=None):
+        """
+        Get statistics of the results by group, streaming through the stored results
+
+        Unlike aggregating the output of get_results_df, only one result is loaded at a time, so the memory used is
+        proportional to the number of groups.
+
+        Args:
+            group_by (list of str): Names of the variables (or results) defining the groups.
+            columns (list of str): Names of the results to aggregate. If None, all the numeric ones are used.
+            stats (list of str): Statistics to compute. Available options are "mean", "sem", "std", "var", "min",
+                                 "max" and "count". Missing (nan) values are skipped, as in pandas.
+            processes (int): Number of processes reading shards of the trials in parallel. If None (or if the results
+                             are kept in memory), the current process is used.
 
-        return pd.DataFrame(results).set_index([v.name for v in self.variables])
+        Returns:
+            pd.DataFrame: A dataframe indexed by the groups whose columns have an additional level with the statistics,
+                          as the output of df_agg_mean with raw=True.
 
-    def invalidate(self, only_grid=False):
         """
-        Remove all existing trial data
+        import pandas as pd
+
+        group_by = list(group_by)
+        self._flush_results()  # Make the results visible to other processes
+        if processes is None or self._memory is not None:
+            partials = [self._accumulate(group_by, columns)]
+        else:
+            with Pool(processes) as pool:
+                partials = pool.starmap(self._accumulate,
+                                        [(group_by, columns, shard, processes) for shard in range(processes)])
+
+        accumulators = partials[0]
+        for partial in partials[1:]:
+            for key, group in partial.items():
+                merged = accumulators.setdefault(key, {})
+                for column, running in group.items():
+                    merged.setdefault(column, RunningStats()).merge(running)
+
+        if columns is None:
+            columns = list(dict.fromkeys(column for group in accumulators.values() for column in group))
+        try:
+            keys = sorted(accumulators)
+        except TypeError:  # Not comparable
+            keys = list(accumulators)
+        empty = RunningStats()
+        data = {(column, stat): [accumulators[key].get(column, empty).get(stat) for key in keys]
+                for column in columns for stat in stats}
+        if len(group_by) == 1:
+            index = pd.Index([key[0] for key in keys], name=group_by[0])
+        else:
+            index = pd.MultiIndex.from_tuples(keys, names=group_by)
+        return pd.DataFrame(data, index=index, columns=pd.MultiIndex.from_tuples(list(data)))
+
+    def invalidate(self, only_grid=False, where=None, stale_only=False):
+        """
+        Remove existing trial data
 
         Args:
-            only_grid (bool): True to remove only files which correspond to grid values. Otherwise, all .pkl files are
-                              removed.
+            only_grid (bool): True to remove only files which correspond to grid values. Otherwise, all .pkl files (and
+                              .ckpt checkpoints and .err error records) are removed.
+            where (callable): A predicate on the kwargs of the trials. If given, only the grid trials for which it is
+                              true are removed.
+            stale_only (bool): Whether to remove only the grid trials whose results were produced by a different
+                               fingerprint of f (or without one). Requires the experiment to use a fingerprint
+                               (and add_stats).
 
         """
-        if only_grid:
+        if stale_only and (self._fingerprint is None or not self.add_stats):
+            # Otherwise, no result has a fingerprint, so all of them would be removed
+            raise ValueError("stale_only requires the experiment to use a fingerprint, stored with add_stats")
+        if only_grid or where is not None or stale_only:
             for kwargs in self.iter_values():
+                if where is not None and not where(kwargs):
+                    continue
+                trial = self._trial(kwargs)
                 try:
-                    Trial(kwargs, self.f, self.store, base_name=self.base_name).delete()
+                    if stale_only:
+                        result = trial.load()
+                        if isinstance(result, dict) and result.get("_fingerprint") == self._fingerprint:
+                            continue
+                    trial.delete()
                 except FileNotFoundError:
                     pass
         else:
-            for file in glob(os.path.join(self.store, "*.pkl")):
-                try:
-                    os.remove(file)
-                except FileNotFoundError:
-                    pass
+            self._flush_results()  # Otherwise, they would be written afterwards
+            if self._memory is not None:
+                self._memory.clear()
+            for pattern in ["*.pkl", "*.ckpt", "*.err"]:
+                for file in glob(os.path.join(self.store, pattern)):
+                    try:
+                        os.remove(file)
+                    except FileNotFoundError:
+                        pass
 
 
 class SubExperiment(Experiment):
@@ -375,4 +1578,11 @@ class SubExperiment(Experiment):
         variables = [a for a in original.variables if a.name not in fixed]
         f = set_kwargs(original.f, fixed)
         store = original.store
-        super().__init__(variables, f, store)
+        super().__init__(variables, f, store, setup=original.setup, teardown=original.teardown,
+                         context_arg=original.context_arg, checkpoint_arg=original.checkpoint_arg,
+                         warm_start_arg=original.warm_start_arg, write_behind=original.write_behind)
+        # Share the results kept in memory
+        self.storage = original.storage
+        self._memory = original._memory
+        # Fingerprint of the original function, not of the closure fixing its kwargs
+        self._fingerprint = original._fingerprint
@@ -0,0 +1,206 @@
+"""Memoization of intermediate results shared by trials (e.g., preprocessing) in a directory"""
+
+import functools
+import inspect
+import json
+import os
+import pickle
+import shutil
+import sys
+import time
+import uuid
+
+from .base import ensure_dir_exists, function_fingerprint, _hash_function
+
+
+class _Pickler(pickle.Pickler):
+    """Pickler storing NumPy arrays as .npy files in a directory, so they can be memory-mapped when loaded"""
+
+    def __init__(self, file, path):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.path = path
+        self.arrays = 0
+
+    def persistent_id(self, obj):
+        if "numpy" not in sys.modules:  # No array can be found
+            return None
+        import numpy as np
+        if type(obj) is not np.ndarray or obj.dtype.hasobject:
+            return None
+        file_name = "%d.npy" % self.arrays
+        self.arrays += 1
+        np.save(os.path.join(self.path, file_name), obj)
+        return file_name
+
+
+class _Unpickler(pickle.Unpickler):
+    """Unpickler opening the arrays stored by _Pickler as read-only memory maps"""
+
+    def __init__(self, file, path):
+        super().__init__(file)
+        self.path = path
+
+    def persistent_load(self, pid):
+        import numpy as np
+        return np.load(os.path.join(self.path, pid), mmap_mode="r")
+
+
+def _entry_size(path):
+    """Number of bytes of the files of an entry"""
+    size = 0
+    for entry in os.scandir(path):
+        try:
+            size += entry.stat().st_size
+        except FileNotFoundError:
+            pass
+    return size
+
+
+def _touch(path):
+    """Mark an entry as recently used, with a finer resolution than the clock of the file system"""
+    now = time.time_ns()
+    os.utime(path, ns=(now, now))
+
+
+def _remove_entry(path):
+    """Remove an entry, first renaming it so no reader finds it partially removed"""
+    removed = "%s.%s.removed" % (path, uuid.uuid4().hex)
+    try:
+        os.rename(path, removed)
+    except FileNotFoundError:  # Already removed by another process
+        return
+    # Processes which have its arrays mapped can still use them
+    shutil.rmtree(removed, ignore_errors=True)
+
+
+class Cache:
+    """A directory of memoized results, evicting the least recently used ones when exceeding a size"""
+
+    def __init__(self, path, max_bytes=None):
+        """
+
+        Args:
+            path (str): Path of the directory storing the results.
+            max_bytes (int): Maximum number of bytes of the stored results. If None, they are never evicted.
+
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key)
+
+    def load(self, key):
+        """
+        Load a stored result
+
+        Args:
+            key (str): The key of the result.
+
+        Returns:
+            tuple: A boolean telling if the result was found and the result (None if not found).
+
+        """
+        path = self._entry_path(key)
+        try:
+            with open(os.path.join(path, "result.pkl"), "rb") as f:
+                result = _Unpickler(f, path).load()
+        except FileNotFoundError:  # Not stored, or evicted meanwhile
+            return False, None
+        try:
+            _touch(path)
+        except FileNotFoundError:
+            pass
+        return True, result
+
+    def save(self, key, result):
+        """Store a result, unless another process already stored it, evicting old ones if needed"""
+        ensure_dir_exists(self.path)
+        path = self._entry_path(key)
+        tmp_path = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+        os.mkdir(tmp_path)
+        try:
+            with open(os.path.join(tmp_path, "result.pkl"), "wb") as f:
+                _Pickler(f, tmp_path).dump(result)
+            os.rename(tmp_path, path)  # Atomic, failing if already stored
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not os.path.isdir(path):
+                raise
+        if self.max_bytes is not None:
+            self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Remove the least recently used results until their size does not exceed max_bytes"""
+        entries = []
+        for entry in os.scandir(self.path):
+            if not entry.is_dir() or entry.name.endswith((".tmp", ".removed")):
+                continue
+            try:
+                entries.append((entry.stat().st_mtime, _entry_size(entry.path), entry.name))
+            except FileNotFoundError:
+                pass
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            _remove_entry(self._entry_path(name))
+            total -= size
+
+    def clear(self):
+        """Remove all the stored results"""
+        if os.path.isdir(self.path):
+            for entry in os.scandir(self.path):
+                if entry.is_dir() and not entry.name.endswith((".tmp", ".removed")):
+                    _remove_entry(entry.path)
+
+
+def memoize(path, max_bytes=None, name=None, version=None):
+    """
+    Decorator storing the results of a function in a directory, shared by the trials, processes and experiments using it
+
+    Results are identified by a hash of the arguments of the function (which must be JSON serializable, as the kwargs
+    of a trial) and a fingerprint of its implementation, so it should only depend on them, e.g., the dataset and the
+    fold of a trial, but not its seed. NumPy arrays in the results are stored as .npy files and returned as read-only
+    memory maps, so workers share them. Results are stored atomically, so concurrent workers can compute the same
+    result, but only one of them is kept.
+
+    Args:
+        path (str): Path of the directory storing the results, e.g., a subdirectory of the store of an experiment.
+        max_bytes (int): Maximum number of bytes of the stored results, evicting the least recently used ones when
+                         exceeded. If None, they are never evicted.
+        name (str): Prefix of the stored results. If None, the name of the function is used.
+        version (str): A version of the function, included in its fingerprint.
+
+    Returns:
+        callable: The decorator. Decorated functions have a cache attribute with the Cache used.
+
+    """
+
+    def decorator(f):
+        signature = inspect.signature(f)
+        prefix = name if name is not None else f.__name__
+        fingerprint = function_fingerprint(f, version)
+        cache = Cache(path, max_bytes=max_bytes)
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            str_form = json.dumps({"kwargs": bound.arguments, "fingerprint": fingerprint}, sort_keys=True)
+            key = "%s-%s" % (prefix, _hash_function(str_form.encode("utf-8")))
+            found, result = cache.load(key)
+            if found:
+                return result
+            result = f(*args, **kwargs)
+            cache.save(key, result)
+            # Return the stored version, so arrays are memory-mapped as in later calls
+            found, stored = cache.load(key)
+            return stored if found else result
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
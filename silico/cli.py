@@ -7,6 +7,7 @@ import importlib
 
 import click
 from .base import Experiment
+from .export import formats, write_results
 
 
 @click.group()
@@ -70,43 +71,33 @@ def status(file, experiment):
 @cli.command()
 @click.option('--experiment', help="Name of the experiment inside of the module.")
 @click.option('--output', "-o", help="Output file. The extension determines the format.")
+@click.option('--chunk-size', default=10000, show_default=True,
+              help="Number of results written at once in the csv, parquet and feather formats.")
 @click.argument('file')
-def export_results(file, output, experiment):
+def export_results(file, output, experiment, chunk_size):
     """Export the results of an experiment"""
     if output is not None and "." not in output:
         print("Error: the output must include an extension")
         return 1
 
-    extensions = {"pkl", "tex", "csv", "json"}  # Must match the code below
-
     if output is not None:
         extension = output.rsplit(".", 1)[-1].lower()
-        if extension not in extensions:
-            print("Invalid extension. Available options are: %s" % ", ".join(extensions))
+        if extension not in formats:
+            print("Invalid extension. Available options are: %s" % ", ".join(sorted(formats)))
             return 1
 
     e = get_experiment(file, experiment)
     if e is None:
         return 1
-    df = e.get_results_df()
     if output is None:
+        df = e.get_results_df()
         print(df)
         print("Preview shown above. Use -o <path> to export, including an extension")
         return 0
 
-    extension = output.rsplit(".", 1)[-1].lower()
-
-    if extension == "pkl":
-        df.to_pickle(output)
-    elif extension == "tex":
-        df.to_latex(output)
-    elif extension == "csv":
-        df.to_csv(output)
-    elif extension == "json":
-        df.to_json(output, indent=1)
-    else:
-        print("Error: unreachable code reached (extension-related problem)")
-        return 1
+    count = write_results(e, output, chunk_size=chunk_size)
+    if count == 0:
+        print("Warning: no results available, %s has no rows" % output)
 
 
 @cli.command()
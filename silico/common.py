@@ -1,3 +1,7 @@
+import math
+import os
+import sys
+import time
 import warnings
 
 # prod
@@ -40,3 +44,193 @@ def set_kwargs(f, fixed_kwargs):
         return f(*args, **fixed_kwargs2, **kwargs)
 
     return f2
+
+
+def exceeds_deadline(deadline, durations):
+    """
+    Check if a new task is expected to finish after a deadline
+
+    Args:
+        deadline (float): Value of time.monotonic() by which tasks should be finished. None for no deadline.
+        durations (list of float): Seconds spent by the previous tasks, whose mean is the expected duration.
+
+    Returns:
+        bool: Whether the task should not be started.
+
+    """
+    if deadline is None:
+        return False
+    expected = sum(durations) / len(durations) if durations else 0
+    return time.monotonic() + expected > deadline
+
+
+# Environment variables read by the native thread pools (BLAS, OpenMP...) when they are loaded
+_THREAD_VARIABLES = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "BLIS_NUM_THREADS",
+                     "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+# Number of native threads set for the current process by limit_inner_threads, if any
+_inner_threads = None
+
+
+def available_cpus():
+    """Number of CPUs the current process can use"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available in some platforms
+        return os.cpu_count() or 1
+
+
+def resolve_inner_threads(inner_threads, workers):
+    """
+    Get the number of native threads to use in each worker
+
+    Args:
+        inner_threads (int or str): The number of threads, "auto" to split the available CPUs between the workers, or
+                                    None not to limit them.
+        workers (int): Number of workers running in parallel.
+
+    Returns:
+        int: The number of threads, or None if not limited.
+
+    """
+    if inner_threads is None:
+        return None
+    if inner_threads == "auto":
+        return max(1, available_cpus() // workers)
+    if not isinstance(inner_threads, int) or inner_threads < 1:
+        raise ValueError("inner_threads must be a positive integer, 'auto' or None")
+    return inner_threads
+
+
+def get_inner_threads():
+    """Get the number of native threads set for the current process, or None if not limited"""
+    return _inner_threads
+
+
+def limit_inner_threads(n):
+    """
+    Limit the number of threads of the native thread pools in the current process
+
+    Libraries already loaded are limited with threadpoolctl, if available. The environment variables are also set, so
+    the limit applies to libraries loaded afterwards and to child processes.
+
+    Args:
+        n (int): The number of threads.
+
+    Returns:
+        callable: A function restoring the previous limits.
+
+    """
+    global _inner_threads
+    previous_threads = _inner_threads
+    previous_env = {variable: os.environ.get(variable) for variable in _THREAD_VARIABLES}
+    for variable in _THREAD_VARIABLES:
+        os.environ[variable] = str(n)
+    try:
+        from threadpoolctl import threadpool_limits
+        limiter = threadpool_limits(limits=n)
+    except ImportError:
+        limiter = None
+    _inner_threads = n
+
+    def restore():
+        global _inner_threads
+        if limiter is not None:
+            limiter.restore_original_limits()
+        for variable, value in previous_env.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+        _inner_threads = previous_threads
+
+    return restore
+
+
+def reset_peak_rss():
+    """Reset the peak resident set size of the current process, if supported (Linux). Returns whether it was reset."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_rss():
+    """
+    Get the peak resident set size of the current process
+
+    Returns:
+        int: The peak in bytes since the process started or since reset_peak_rss was called, or None if unknown.
+
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Not available in Windows
+        return None
+    # ru_maxrss is never reset, so this might overestimate the peak after reset_peak_rss
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RunningStats:
+    """Running count, mean, variance, minimum and maximum of a sequence of numbers (Welford's algorithm)"""
+
+    __slots__ = ("count", "mean", "m2", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        """Add a value to the sequence"""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        """Add the values of another sequence (Chan's parallel algorithm)"""
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def get(self, stat):
+        """Get a statistic: "count", "mean", "var", "std", "sem", "min" or "max"."""
+        if stat == "count":
+            return self.count
+        if self.count == 0:
+            return math.nan
+        if stat == "mean":
+            return self.mean
+        elif stat == "min":
+            return self.min
+        elif stat == "max":
+            return self.max
+        var = self.m2 / (self.count - 1) if self.count > 1 else math.nan
+        if stat == "var":
+            return var
+        elif stat == "std":
+            return math.sqrt(var)
+        elif stat == "sem":
+            return math.sqrt(var / self.count)
+        raise ValueError("Invalid statistic %s" % stat)
@@ -4,6 +4,7 @@ import importlib
 import curses
 
 from .base import Experiment
+from .export import formats, write_results
 
 # Constants for positioning
 EXPERIMENT_LIST_START = 2
@@ -125,21 +126,12 @@ def run_cui(module_name):
 
     def export_results(experiment, output_file):
         """Handles export logic based on the provided file name."""
-        extensions = {"pkl", "tex", "csv", "json"}
         extension = output_file.rsplit(".", 1)[-1].lower()
 
-        if extension not in extensions:
-            return f"Invalid extension. Available options are: {', '.join(extensions)}."
-
-        df = experiment.get_results_df()
-        if extension == "pkl":
-            df.to_pickle(output_file)
-        elif extension == "tex":
-            df.to_latex(output_file)
-        elif extension == "csv":
-            df.to_csv(output_file)
-        elif extension == "json":
-            df.to_json(output_file, indent=1)
+        if extension not in formats:
+            return f"Invalid extension. Available options are: {', '.join(sorted(formats))}."
+
+        write_results(experiment, output_file)
         return f"Results saved to {output_file}."
 
     def handle_user_input(stdscr):
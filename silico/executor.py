@@ -0,0 +1,321 @@
+"""Pool of killable worker processes to run trials"""
+
+import multiprocessing
+import statistics
+import time
+from collections import Counter
+from multiprocessing.connection import wait
+
+from .common import exceeds_deadline, limit_inner_threads
+
+# Returned by ProcessExecutor._admit when no task is left
+_NO_MORE_TASKS = object()
+
+# Maximum number of seconds a run waiting for its workers takes to notice it was cancelled
+_CANCEL_POLL_SECONDS = 0.1
+
+
+def _worker_main(conn, experiments, inner_threads=None):
+    """Loop run in the worker processes, executing the tasks received through the connection"""
+    if inner_threads is not None:
+        limit_inner_threads(inner_threads)
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if task is None:
+            break
+        index, kwargs, options = task
+        if "inputs" in options:
+            # References to trials of the experiments, given as (index, kwargs)
+            options = {**options, "inputs": {arg: experiments[i]._trial(input_kwargs)
+                                             for arg, (i, input_kwargs) in options["inputs"].items()}}
+        conn.send(experiments[index]._run_trial(kwargs, **options))
+    for experiment in experiments:
+        experiment._teardown_contexts()
+        experiment._flush_results()
+
+
+class _Worker:
+    """A worker process and the task it is running, if any"""
+
+    def __init__(self, context, experiments, inner_threads=None):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, experiments, inner_threads),
+                                       daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.start = None
+        self.memory = 0
+
+    def submit(self, task, memory=0):
+        self.task = task
+        self.start = time.monotonic()
+        self.memory = memory
+        self.conn.send(task)
+
+    def release(self):
+        """Mark the worker as idle, returning the task it was running and the seconds elapsed"""
+        task, elapsed = self.task, time.monotonic() - self.start
+        self.task = None
+        self.start = None
+        self.memory = 0
+        return task, elapsed
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join()
+        self.conn.close()
+
+
+class ProcessExecutor:
+    """A pool of worker processes which can be killed when a trial exceeds its time limit"""
+
+    def __init__(self, experiments, processes=2, timeout=None, inner_threads=None, memory_limit=None,
+                 memory_estimator=None, memory_default=None, lookahead=None, speculate=None, duration_estimator=None):
+        """
+
+        Args:
+            experiments (list of Experiment): The experiments whose trials are run. Tasks refer to them by index.
+            processes (int): Number of worker processes.
+            timeout (float): Maximum number of seconds a trial may run. When exceeded, its worker is killed and
+                             replaced, and the timeout is stored as an error of the trial.
+            inner_threads (int): Number of threads of the native thread pools of each worker. None not to limit them.
+            memory_limit (int): Maximum number of bytes the running trials are estimated to use. A trial is started
+                                only if it fits with the running ones, or if no other is running.
+            memory_estimator (callable): A function mapping the kwargs of a trial to the estimated peak of memory in
+                                         bytes of the process running it, or None if unknown (then memory_default is
+                                         used).
+            memory_default (int): Estimated peak of memory in bytes of the trials without an estimate. If None, they
+                                  are assumed to need the whole memory_limit.
+            lookahead (int): Number of upcoming tasks considered when the next one does not fit in the memory. A task
+                             which has been overtaken this many times is no longer overtaken. Defaults to twice the
+                             number of processes.
+            speculate (float): If given, when a worker is idle because no other task can be started, it runs a copy of
+                               a task which has been running more than speculate times its expected duration. The
+                               first copy to finish is kept and the others are killed.
+            duration_estimator (callable): A function mapping the kwargs of a trial to its expected duration in
+                                           seconds, or None if unknown (then the median duration of the tasks run so
+                                           far is used).
+
+        """
+        self.experiments = experiments
+        self.processes = processes
+        self.timeout = timeout
+        self.inner_threads = inner_threads
+        self.memory_limit = memory_limit
+        self.memory_estimator = memory_estimator
+        self.memory_default = memory_default if memory_default is not None else memory_limit
+        self.lookahead = lookahead if lookahead is not None else 2 * processes
+        self.speculate = speculate
+        self.duration_estimator = duration_estimator
+        self._context = multiprocessing.get_context()
+
+    def _new_worker(self):
+        return _Worker(self._context, self.experiments, self.inner_threads)
+
+    def _record_failure(self, task, elapsed, message):
+        index, kwargs, _ = task
+        self.experiments[index]._record_failure(kwargs, elapsed, message)
+
+    def _estimate_memory(self, task):
+        estimate = self.memory_estimator(task[1]) if self.memory_estimator is not None else None
+        return self.memory_default if estimate is None else estimate
+
+    def _admit(self, tasks, pending, workers):
+        """
+        Take the next task to start
+
+        Args:
+            tasks (iterator): The tasks not yet considered.
+            pending (list): Tasks considered but not started, with the number of times they were overtaken.
+            workers (list of _Worker): The workers.
+
+        Returns:
+            tuple: The task and its estimated memory, None if no task can be started now, or _NO_MORE_TASKS.
+
+        """
+        window = self.lookahead if self.memory_limit is not None else 1
+        exhausted = False
+        while len(pending) < window:
+            task = next(tasks, _NO_MORE_TASKS)
+            if task is _NO_MORE_TASKS:
+                exhausted = True
+                break
+            if task is None:  # No task is ready until a running one finishes
+                break
+            pending.append([task, 0])
+        if not pending:
+            return _NO_MORE_TASKS if exhausted else None
+        if self.memory_limit is None:
+            return pending.pop(0)[0], 0
+
+        running = [w for w in workers if w.task is not None]
+        available = self.memory_limit - sum(w.memory for w in running)
+        for i, (task, overtaken) in enumerate(pending):
+            memory = self._estimate_memory(task)
+            if not running or memory <= available:
+                del pending[i]
+                for entry in pending[:i]:
+                    entry[1] += 1
+                return task, memory
+            if overtaken >= self.lookahead:
+                # Wait for this one to fit, not to postpone it forever
+                break
+        return None
+
+    def _stragglers(self, workers, durations):
+        """Get the workers running tasks without copies, with the time they become stragglers, soonest first"""
+        copies = Counter(id(w.task) for w in workers if w.task is not None)
+        stragglers = []
+        for worker in workers:
+            if worker.task is None or copies[id(worker.task)] > 1:
+                continue
+            expected = self.duration_estimator(worker.task[1]) if self.duration_estimator is not None else None
+            if expected is None:
+                if not durations:
+                    continue
+                expected = statistics.median(durations)
+            stragglers.append((worker.start + self.speculate * expected, worker))
+        stragglers.sort(key=lambda s: s[0])
+        return stragglers
+
+    def _speculate(self, workers, durations):
+        """Run copies of the stragglers in the idle workers"""
+        idle = [w for w in workers if w.task is None]
+        now = time.monotonic()
+        for since, straggler in self._stragglers(workers, durations):
+            if not idle or since > now:
+                break
+            if self.memory_limit is not None:
+                available = self.memory_limit - sum(w.memory for w in workers if w.task is not None)
+                if straggler.memory > available:
+                    continue
+            idle.pop().submit(straggler.task, straggler.memory)
+
+    def _kill(self, worker):
+        """Kill a worker, removing the temporary files it might have been writing"""
+        pid = worker.process.pid
+        worker.kill()
+        for experiment in {e.store: e for e in self.experiments}.values():
+            experiment._remove_tmp_files(pid)
+
+    def _replace_worker(self, workers, i):
+        """Kill a worker, returning the task it was running and the seconds elapsed, and start a new one"""
+        task, elapsed = workers[i].release()
+        self._kill(workers[i])
+        workers[i] = self._new_worker()
+        return task, elapsed
+
+    def _running_copies(self, workers, task):
+        return [i for i, w in enumerate(workers) if w.task is task]
+
+    def run(self, tasks, deadline=None, cancel_event=None):
+        """
+        Run the given tasks
+
+        Args:
+            tasks (iterable of tuples): Experiment index, kwargs and options (arguments of Experiment._run_trial) of the
+                                        trials to run. Inputs in the options are given as (experiment index, kwargs)
+                                        references. The iterable may also give None when no task is ready until a
+                                        running one finishes.
+            deadline (float): Value of time.monotonic() after which no new task is started. Tasks are not started
+                              either if the mean duration of the tasks run so far would exceed it.
+            cancel_event (threading.Event): An event which, when set, stops the run, killing the running tasks.
+
+        Yields:
+            tuple: For each finished task, the task and the seconds spent running it (None if it was already
+                   available).
+
+        """
+        tasks = iter(tasks)
+        workers = [self._new_worker() for _ in range(self.processes)]
+        durations = []
+        pending = []
+        exhausted = False
+        try:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                # Dispatch to idle workers
+                for worker in workers:
+                    if exhausted:
+                        break
+                    if worker.task is not None:
+                        continue
+                    if exceeds_deadline(deadline, durations):
+                        exhausted = True
+                        break
+                    admitted = self._admit(tasks, pending, workers)
+                    if admitted is _NO_MORE_TASKS:
+                        exhausted = True
+                        break
+                    if admitted is None:
+                        # None is ready or fits in the memory until some finishes
+                        break
+                    worker.submit(*admitted)
+
+                speculating = exhausted and self.speculate is not None
+                if speculating:
+                    self._speculate(workers, durations)
+
+                busy = [w for w in workers if w.task is not None]
+                if not busy:
+                    break
+
+                # Wake up for the next timeout, or when a task becomes a straggler if a worker is idle
+                wake_times = []
+                if self.timeout is not None:
+                    wake_times.extend(w.start + self.timeout for w in busy)
+                if speculating and len(busy) < len(workers):
+                    wake_times.extend(since for since, _ in self._stragglers(workers, durations))
+                if cancel_event is not None:
+                    wake_times.append(time.monotonic() + _CANCEL_POLL_SECONDS)
+                wait_time = max(0.0, min(wake_times) - time.monotonic()) if wake_times else None
+
+                ready = wait([w.conn for w in busy], timeout=wait_time)
+                for i, worker in enumerate(workers):
+                    if worker.task is None:
+                        continue
+                    if worker.conn in ready:
+                        try:
+                            spent = worker.conn.recv()
+                        except EOFError:
+                            # The process died (e.g., killed by the OS)
+                            task, elapsed = self._replace_worker(workers, i)
+                            if self._running_copies(workers, task):
+                                continue
+                            self._record_failure(task, elapsed, "Worker process died while running the trial")
+                            durations.append(elapsed)
+                            yield task, elapsed
+                            continue
+                        task, _ = worker.release()
+                        # The first copy to finish wins
+                        for j in self._running_copies(workers, task):
+                            self._replace_worker(workers, j)
+                        if spent is not None:
+                            durations.append(spent)
+                        yield task, spent
+                    elif self.timeout is not None and time.monotonic() - worker.start >= self.timeout:
+                        task, elapsed = self._replace_worker(workers, i)
+                        if self._running_copies(workers, task):
+                            continue
+                        self._record_failure(task, elapsed, "Timeout: trial exceeded %g seconds" % self.timeout)
+                        durations.append(elapsed)
+                        yield task, elapsed
+        finally:
+            for worker in workers:
+                if worker.task is None:
+                    worker.close()
+                else:
+                    self._kill(worker)
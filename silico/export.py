@@ -0,0 +1,144 @@
+"""Export of the results of experiments to files"""
+
+import os
+
+formats = {"pkl", "tex", "csv", "json", "parquet", "feather", "arrow"}
+"""Available output formats, given by the extension of the file"""
+
+streaming_formats = {"csv", "parquet", "feather", "arrow"}
+"""Formats written chunk by chunk, without building the whole dataframe"""
+
+
+def _union_columns(chunks):
+    """Get the columns of all the chunks, in order of appearance"""
+    columns = {}
+    for df in chunks:
+        columns.update(dict.fromkeys(df.columns))
+    return list(columns)
+
+
+def _conform(df, columns):
+    """Ensure a chunk of results has the given columns, in that order, adding the missing ones as empty"""
+    extra = [c for c in df.columns if c not in columns]
+    if extra:
+        raise ValueError("Results changed while being written, adding columns: %s" % ", ".join(map(str, extra)))
+    return df.reindex(columns=columns)
+
+
+def _write_csv(iter_chunks, output):
+    columns = _union_columns(iter_chunks())
+    count = 0
+    with open(output, "w", newline="") as f:
+        for df in iter_chunks():
+            _conform(df, columns).to_csv(f, header=count == 0)
+            count += len(df)
+    return count
+
+
+def _arrow_types(iter_chunks):
+    """Get the columns of all the chunks, in order of appearance, and a schema with types holding all their values"""
+    import pyarrow as pa
+
+    columns = {}
+    schemas = []
+    for df in iter_chunks():
+        columns.update(dict.fromkeys(df.columns))
+        schemas.append(pa.Schema.from_pandas(df, preserve_index=True).remove_metadata())
+    if not schemas:
+        return [], None
+    try:
+        # E.g., a result which is None in some chunks and a float in others, or an int missing in some rows
+        types = pa.unify_schemas(schemas, promote_options="permissive")
+    except TypeError:  # Older pyarrow versions, only unifying null types
+        types = pa.unify_schemas(schemas)
+    return list(columns), types
+
+
+def _write_arrow(iter_chunks, output, extension):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ModuleNotFoundError("The pyarrow package is required")
+
+    columns, types = _arrow_types(iter_chunks)
+    writer = None
+    schema = None
+    count = 0
+    try:
+        for df in iter_chunks():
+            # The index is stored with the pandas metadata, so the variables are restored as a MultiIndex
+            table = pa.Table.from_pandas(_conform(df, columns), preserve_index=True)
+            if writer is None:
+                schema = pa.schema([types.field(name) for name in table.schema.names], metadata=table.schema.metadata)
+                if extension == "parquet":
+                    writer = pq.ParquetWriter(output, schema)
+                else:
+                    writer = pa.ipc.new_file(output, schema)
+            writer.write_table(table.cast(schema))
+            count += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+def _write_frame(experiment, output, extension):
+    df = experiment.get_results_df()
+    if extension == "pkl":
+        df.to_pickle(output, compression=None)
+    elif extension == "tex":
+        df.to_latex(output)
+    elif extension == "json":
+        df.to_json(output, indent=1)
+    return len(df)
+
+
+def write_results(experiment, output, chunk_size=10000):
+    """
+    Write the results of an experiment to a file
+
+    The csv, parquet and feather/arrow (Arrow IPC) formats are written while iterating the results, in chunks (or row
+    groups) of chunk_size rows, so the memory used is bounded. The results are read twice: first to find the columns
+    (and their types) of all of them, then to write them. The parquet and feather formats preserve the index of
+    variables and the column types, so they can be read back with pd.read_parquet or pd.read_feather. Other formats
+    require building the whole dataframe.
+
+    The file is written to a temporary path, renamed to the output only if successful. If there are no results, a file
+    with no rows is written, with the variables as its index.
+
+    Args:
+        experiment (Experiment): The experiment.
+        output (str): Path of the output file. The extension determines the format (see formats).
+        chunk_size (int): Number of results written at once by the streaming formats.
+
+    Returns:
+        int: Number of results written.
+
+    """
+    extension = output.rsplit(".", 1)[-1].lower()
+    if extension not in formats:
+        raise ValueError("Invalid extension. Available options are: %s" % ", ".join(sorted(formats)))
+
+    def iter_chunks():
+        empty = True
+        for df in experiment.iter_results_df(chunk_size=chunk_size):
+            empty = False
+            yield df
+        if empty:  # Only the index of variables, so the file is still written
+            yield experiment._results_frame([])
+
+    tmp_path = "%s.%d.tmp" % (output, os.getpid())
+    try:
+        if extension == "csv":
+            count = _write_csv(iter_chunks, tmp_path)
+        elif extension in streaming_formats:
+            count = _write_arrow(iter_chunks, tmp_path, extension)
+        else:
+            count = _write_frame(experiment, tmp_path, extension)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, output)
+    return count
@@ -1,60 +1,166 @@
 from collections import OrderedDict
 
-from sklearn import metrics
-
 import numpy as np
 
-from .common import set_kwargs
+_average_criteria = ['micro', 'macro', 'weighted']
+"""Criteria to average a target-dependent metric. Note None can be used instead to retrieve the list of
+target-dependent values"""
 
-# Available metrics for binary classifiers, not depending on a target class
-_classifier_metrics = OrderedDict([
-    ("Accuracy", metrics.accuracy_score),
-    ("Cohen kappa", metrics.cohen_kappa_score),
-    ("Matthews Phi", metrics.matthews_corrcoef),
-])
 
-# TODO: Not used yet
-# ROC uses probability score instead of values
-_classifier_score_metrics = OrderedDict([
-    ("ROC AUC", metrics.roc_auc_score),
-])
+def _encode_labels(y, predictions, classes):
+    """
+    Encode the labels as indices of their sorted union
 
-_classifier_metrics_averaged = OrderedDict([
-    ("Precision", lambda criterium: set_kwargs(metrics.precision_score, {'average': criterium})),
-    ("Recall", lambda criterium: set_kwargs(metrics.recall_score, {'average': criterium})),
-    ("F1", lambda criterium: set_kwargs(metrics.f1_score, {'average': criterium}))
-])
+    Args:
+        y (np.ndarray): True labels, with shape (n_samples,).
+        predictions (np.ndarray): Predicted labels, with shape (n_trials, n_samples).
+        classes (list): Labels whose target-dependent metrics are requested.
 
-_average_criteria = ['micro', 'macro', 'weighted']
-"""Criteria to average a target-dependent metric. Note None can be used instead to retrieve the list of
-target-dependent values"""
+    Returns:
+        tuple: Number of labels, encoded y, encoded predictions and indices of the classes.
+
+    """
+    if y.ndim != 1 or predictions.ndim != 2 or predictions.shape[1] != len(y) or len(y) == 0:
+        raise ValueError("Invalid shape of the labels")
+    classes = np.asarray(classes)
+    if not classes.size:
+        classes = classes.astype(y.dtype)
+    kinds = {a.dtype.kind in "biuf" for a in (y, predictions, classes) if a.size}
+    if len(kinds) > 1:
+        raise ValueError("Mix of numeric and non-numeric labels")
+    for a in (y, predictions):
+        if a.dtype.kind == "f" and np.any(a != np.round(a)):
+            raise ValueError("Continuous values are not valid labels")
+    labels = np.unique(np.concatenate([y, predictions.ravel(), classes.ravel()]))
+    return (len(labels), np.searchsorted(labels, y), np.searchsorted(labels, predictions),
+            np.searchsorted(labels, classes))
+
+
+def _divide(num, den):
+    """Elementwise division taking 0 where the denominator is 0"""
+    return np.divide(num, den, out=np.zeros(np.broadcast(num, den).shape), where=den != 0)
+
+
+def _metrics_from_confusion(m, class_indices):
+    """
+    Compute the metrics from a stack of confusion matrices
+
+    Args:
+        m (np.ndarray): Confusion matrices, with shape (n_trials, n_labels, n_labels) (true labels in rows).
+        class_indices (np.ndarray): Indices of the labels whose target-dependent metrics are returned.
+
+    Returns:
+        OrderedDict: Mapping of metric names to arrays with a value for each trial.
+
+    """
+    m = m.astype(float)
+    n = m.sum(axis=(1, 2))
+    tp = np.diagonal(m, axis1=1, axis2=2)
+    t_sum = m.sum(axis=2)  # Support of each label
+    p_sum = m.sum(axis=1)  # Times each label is predicted
+    correct = tp.sum(axis=1)
+    # Labels present either in the true values or in the predictions, which are the ones averaged
+    present = (t_sum + p_sum) > 0
+
+    par_list = [("Accuracy", correct / n)]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        chance = (t_sum * p_sum).sum(axis=1) / n
+        par_list.append(("Cohen kappa", 1 - (n - correct) / (n - chance)))
+
+    cov_ytyp = correct * n - (t_sum * p_sum).sum(axis=1)
+    cov_ypyp = n ** 2 - (p_sum * p_sum).sum(axis=1)
+    cov_ytyt = n ** 2 - (t_sum * t_sum).sum(axis=1)
+    par_list.append(("Matthews Phi", _divide(cov_ytyp, np.sqrt(cov_ytyt * cov_ypyp))))
+
+    per_label = OrderedDict([
+        ("Precision", (_divide(tp, p_sum), correct / p_sum.sum(axis=1))),
+        ("Recall", (_divide(tp, t_sum), correct / t_sum.sum(axis=1))),
+        ("F1", (_divide(2 * tp, t_sum + p_sum), 2 * correct / (t_sum + p_sum).sum(axis=1))),
+    ])
+    for metric, (values, micro) in per_label.items():
+        par_list.append((metric, OrderedDict([
+            ("micro", micro),
+            ("macro", (values * present).sum(axis=1) / present.sum(axis=1)),
+            ("weighted", (values * t_sum).sum(axis=1) / t_sum.sum(axis=1)),
+            ("target", values[:, class_indices]),
+        ])))
+
+    return OrderedDict(par_list)
+
+
+def get_classification_metrics_batch(y, predictions, classes=None):
+    """
+    Get the classification metrics of several predictions of the same true labels at once
+
+    Args:
+        y (list): True labels.
+        predictions (list of list): Predicted labels of each trial, with shape (n_trials, n_samples).
+        classes (list): Labels whose target-dependent metrics are given, in this order. Defaults to those in y.
+
+    Returns:
+        OrderedDict: Same mapping as get_classification_metrics, with arrays of the values of each trial instead of
+                     numbers (the "target" entries have shape (n_trials, n_classes)).
+
+    """
+    y = np.asarray(y)
+    predictions = np.asarray(predictions)
+    if classes is None:
+        classes = list(set(y.tolist()))
+    n_labels, y_index, predictions_index, class_indices = _encode_labels(y, predictions, classes)
+    n_trials = len(predictions)
+    flat = (np.arange(n_trials).reshape(-1, 1) * n_labels + y_index) * n_labels + predictions_index
+    m = np.bincount(flat.ravel(), minlength=n_trials * n_labels * n_labels).reshape(n_trials, n_labels, n_labels)
+    return _metrics_from_confusion(m, class_indices)
 
 
 def get_classification_metrics(y, predictions, classes=None):
+    """
+    Get a mapping of metrics of a classification
+
+    All the metrics are derived from a single confusion matrix, matching those of scikit-learn (taking 0 for the
+    ill-defined precision, recall and F1 of a label).
+
+    Args:
+        y (list): True labels.
+        predictions (list): Predicted labels.
+        classes (list): Labels whose target-dependent metrics are given, in this order. Defaults to those in y.
+
+    Returns:
+        OrderedDict: Mapping of metric names to their values. Precision, Recall and F1 map the averaging criteria
+                     (micro, macro, weighted) to their values, and "target" to the list of values of each class. If
+                     the labels are not valid, the values are nan.
+
+    """
     if classes is None:
         classes = list(set(y))
-    par_list = []
-    # Fixed pars
-    for metric, f in _classifier_metrics.items():
-        try:
-            par_list.append((metric, f(y, predictions)))
-        except (ValueError, TypeError) as e:
-            par_list.append((metric, np.nan))
-
-    # Parameters depending on target/averaged
-    for metric, f in _classifier_metrics_averaged.items():
-        try:
-            par_list.append((metric,
-                             {**{criterium: f(criterium)(y, predictions) for
-                                 criterium in _average_criteria}, **{
-                                 "target": f(None)(y, predictions,
-                                                   labels=classes).tolist()}}))
-        except (ValueError, TypeError) as e:
-            par_list.append((metric, np.nan))
+    try:
+        batch = get_classification_metrics_batch(y, [predictions], classes=classes)
+    except (ValueError, TypeError):
+        return OrderedDict((metric, np.nan) for metric in
+                           ["Accuracy", "Cohen kappa", "Matthews Phi", "Precision", "Recall", "F1"])
 
+    par_list = []
+    for metric, value in batch.items():
+        if isinstance(value, OrderedDict):
+            par_list.append((metric, {**{criterium: float(value[criterium][0]) for criterium in _average_criteria},
+                                      "target": value["target"][0].tolist()}))
+        else:
+            par_list.append((metric, float(value[0])))
     return OrderedDict(par_list)
 
 
+def get_regression_metrics(y, predictions):
+    """Get a mapping of metrics of a regression (R2, mean absolute and squared errors)"""
+    from sklearn import metrics
+
+    return OrderedDict([
+        ("R2", metrics.r2_score(y, predictions)),
+        ("MAE", metrics.mean_absolute_error(y, predictions)),
+        ("MSE", metrics.mean_squared_error(y, predictions)),
+    ])
+
+
 def plot_confusion_matrix(m, labels=None, figure_kwargs=None, normalize=None):
     """
 
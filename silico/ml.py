@@ -1,43 +1,288 @@
 """Common sklearn predictors"""
 
-# Classification methods
-from sklearn.dummy import DummyClassifier
-from sklearn.neural_network import MLPClassifier
-from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier, GradientBoostingClassifier
-from sklearn.tree import DecisionTreeClassifier
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.svm import SVC
-from sklearn.linear_model import LogisticRegression
-
-# Regression methods
-from sklearn.dummy import DummyRegressor
-from sklearn.neural_network import MLPRegressor
-from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor, GradientBoostingRegressor
-from sklearn.tree import DecisionTreeRegressor
-from sklearn.neighbors import KNeighborsRegressor
-from sklearn.svm import SVR
-from sklearn.linear_model import LinearRegression
+import os
+import time
+from collections.abc import MutableMapping
+from importlib import import_module
 
 from .common import set_kwargs
 
+
+class _LazyRegistry(MutableMapping):
+    """
+    A mapping of user-friendly names to predictors, importing them from sklearn on first access
+
+    Predictors can be added (or replaced) as in a dict, e.g., registry["mine"] = MyPredictor.
+    """
+
+    def __init__(self, specs):
+        """
+
+        Args:
+            specs (dict): A mapping of names to (module, class name, fixed kwargs) tuples.
+
+        """
+        self._specs = specs
+        self._resolved = {}
+
+    def __getitem__(self, key):
+        if key not in self._resolved:
+            module, name, fixed = self._specs[key]
+            predictor = getattr(import_module(module), name)
+            self._resolved[key] = set_kwargs(predictor, fixed) if fixed else predictor
+        return self._resolved[key]
+
+    def __setitem__(self, key, predictor):
+        self._specs[key] = None
+        self._resolved[key] = predictor
+
+    def __delitem__(self, key):
+        del self._specs[key]
+        self._resolved.pop(key, None)
+
+    def __iter__(self):
+        return iter(self._specs)
+
+    def __len__(self):
+        return len(self._specs)
+
+
 # Mapping of user-friendly names to Classifier
-classifiers = {"baseline": set_kwargs(DummyClassifier, {"strategy": "stratified"}),
-               "logistic": set_kwargs(LogisticRegression, {"solver": "lbfgs", "multi_class": "auto"}),
-               "svm": set_kwargs(SVC, {"gamma": "scale"}),
-               "k-neighbors": KNeighborsClassifier,
-               "decision-tree": DecisionTreeClassifier,
-               "random-forest": set_kwargs(RandomForestClassifier, {"n_estimators": 100}),
-               "extra-trees": set_kwargs(ExtraTreesClassifier, {"n_estimators": 100}),
-               "gradient-boosting": GradientBoostingClassifier,
-               "mlp": MLPClassifier, }
+classifiers = _LazyRegistry({
+    "baseline": ("sklearn.dummy", "DummyClassifier", {"strategy": "stratified"}),
+    "logistic": ("sklearn.linear_model", "LogisticRegression", {"solver": "lbfgs"}),
+    "svm": ("sklearn.svm", "SVC", {"gamma": "scale"}),
+    "k-neighbors": ("sklearn.neighbors", "KNeighborsClassifier", None),
+    "decision-tree": ("sklearn.tree", "DecisionTreeClassifier", None),
+    "random-forest": ("sklearn.ensemble", "RandomForestClassifier", {"n_estimators": 100}),
+    "extra-trees": ("sklearn.ensemble", "ExtraTreesClassifier", {"n_estimators": 100}),
+    "gradient-boosting": ("sklearn.ensemble", "GradientBoostingClassifier", None),
+    "mlp": ("sklearn.neural_network", "MLPClassifier", None),
+})
 
 # Mapping of user-friendly names to Regressor
-regressors = {"baseline": DummyRegressor,
-              "linear": LinearRegression,
-              "svm": set_kwargs(SVR, {"gamma": "scale"}),
-              "k-neighbors": KNeighborsRegressor,
-              "decision-tree": DecisionTreeRegressor,
-              "random-forest": set_kwargs(RandomForestRegressor, {"n_estimators": 100}),
-              "extra-trees": set_kwargs(ExtraTreesRegressor, {"n_estimators": 100}),
-              "gradient-boosting": GradientBoostingRegressor,
-              "mlp": MLPRegressor, }
+regressors = _LazyRegistry({
+    "baseline": ("sklearn.dummy", "DummyRegressor", None),
+    "linear": ("sklearn.linear_model", "LinearRegression", None),
+    "svm": ("sklearn.svm", "SVR", {"gamma": "scale"}),
+    "k-neighbors": ("sklearn.neighbors", "KNeighborsRegressor", None),
+    "decision-tree": ("sklearn.tree", "DecisionTreeRegressor", None),
+    "random-forest": ("sklearn.ensemble", "RandomForestRegressor", {"n_estimators": 100}),
+    "extra-trees": ("sklearn.ensemble", "ExtraTreesRegressor", {"n_estimators": 100}),
+    "gradient-boosting": ("sklearn.ensemble", "GradientBoostingRegressor", None),
+    "mlp": ("sklearn.neural_network", "MLPRegressor", None),
+})
+
+
+# Memory-mapped arrays already opened by this process, by path
+_mapped_arrays = {}
+
+
+def _load_mapped(path):
+    """Open a .npy file as a read-only memory map, reusing it if already opened by this process"""
+    if path not in _mapped_arrays:
+        import numpy as np
+        _mapped_arrays[path] = np.load(path, mmap_mode="r")
+    return _mapped_arrays[path]
+
+
+def _store_array(path, array):
+    """Store an array as a .npy file, unless an identical one is already there"""
+    import numpy as np
+    if os.path.exists(path):
+        stored = np.load(path, mmap_mode="r")
+        if stored.shape == array.shape and stored.dtype == array.dtype and np.array_equal(stored, array):
+            return
+    # Write and rename, so processes which have the previous file mapped are not affected
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+    _mapped_arrays.pop(path, None)
+
+
+class _ZooTrial:
+    """Pickleable function cross-validating a predictor from the zoo on a dataset stored as memory-mapped files"""
+
+    def __init__(self, paths, classes, task, n_splits, model_kwargs, n_estimators=None):
+        self.paths = paths
+        self.classes = classes
+        self.task = task
+        self.n_splits = n_splits
+        self.model_kwargs = model_kwargs
+        self.n_estimators = sorted(n_estimators) if n_estimators is not None else None
+        # The experiment running the trials, used to store the results of the smaller values of n_estimators
+        self.experiment = None
+
+    def __call__(self, model, dataset, fold, seed, n_estimators=None):
+        from sklearn.model_selection import KFold, StratifiedKFold
+
+        X = _load_mapped(self.paths[dataset][0])
+        y = _load_mapped(self.paths[dataset][1])
+
+        if self.task == "classification":
+            splitter = StratifiedKFold(self.n_splits, shuffle=True, random_state=seed)
+            predictor = classifiers[model](**self.model_kwargs.get(model, {}))
+        else:
+            splitter = KFold(self.n_splits, shuffle=True, random_state=seed)
+            predictor = regressors[model](**self.model_kwargs.get(model, {}))
+        if "random_state" in predictor.get_params():
+            predictor.set_params(random_state=seed)
+
+        train, test = next(s for i, s in enumerate(splitter.split(X, y)) if i == fold)
+
+        if n_estimators is not None:
+            kwargs = {"model": model, "dataset": dataset, "fold": fold, "seed": seed}
+            return self._run_incremental(predictor, X, y, train, test, dataset, kwargs, n_estimators)
+
+        start = time.perf_counter()
+        predictor.fit(X[train], y[train])
+        fit_seconds = time.perf_counter() - start
+
+        return {**self._evaluate(predictor, X, y, test, dataset), "fit_seconds": fit_seconds}
+
+    def _evaluate(self, predictor, X, y, test, dataset):
+        """Get the metrics of the predictions on the test set and the time spent predicting"""
+        start = time.perf_counter()
+        predictions = predictor.predict(X[test])
+        predict_seconds = time.perf_counter() - start
+
+        if self.task == "classification":
+            from .metrics import get_classification_metrics
+            metrics = get_classification_metrics(y[test], predictions, classes=self.classes[dataset])
+        else:
+            from .metrics import get_regression_metrics
+            metrics = get_regression_metrics(y[test], predictions)
+
+        return {**metrics, "predict_seconds": predict_seconds}
+
+    def _save_sibling(self, kwargs, result, start, elapsed):
+        """Store the result of another value of n_estimators as a trial of the experiment, unless available"""
+        trial = self.experiment._trial(kwargs)
+        if trial.is_available():
+            return
+        if not self.experiment.add_stats:
+            trial.save(result)
+            return
+        attempts = trial.get_attempts()
+        trial.save({**trial.get_stats(start, elapsed, attempts), **result})
+        if attempts > 1:
+            trial.get_error_record().delete()
+
+    def _run_incremental(self, predictor, X, y, train, test, dataset, kwargs, n_estimators):
+        """
+        Fit a predictor up to a value of n_estimators in a single pass, storing the results of the smaller values
+
+        Ensembles supporting warm_start grow their trees from the previous fit, so fit_seconds is cumulative. Other
+        predictors do not depend on n_estimators, so they are fit once and share the results.
+        """
+        from datetime import datetime
+
+        params = predictor.get_params()
+        incremental = "n_estimators" in params and "warm_start" in params
+        if incremental:
+            predictor.set_params(warm_start=True)
+
+        run_start = datetime.now()
+        fit_seconds = 0.0
+        metrics = None
+        for value in self.n_estimators:
+            if value > n_estimators:
+                break
+            if incremental or metrics is None:
+                if incremental:
+                    predictor.set_params(n_estimators=value)
+                start = time.perf_counter()
+                predictor.fit(X[train], y[train])
+                fit_seconds += time.perf_counter() - start
+                metrics = self._evaluate(predictor, X, y, test, dataset)
+            if value < n_estimators and self.experiment is not None:
+                elapsed = (datetime.now() - run_start).total_seconds()
+                self._save_sibling({**kwargs, "n_estimators": value}, {**metrics, "fit_seconds": fit_seconds},
+                                   run_start, elapsed)
+        return {**metrics, "fit_seconds": fit_seconds}
+
+
+def _zoo_digest(arrays, task, n_splits, model_kwargs, n_estimators):
+    """Get a string identifying the configuration of a zoo experiment which is not part of the variables"""
+    import hashlib
+    import json
+
+    h = hashlib.md5()
+    h.update(json.dumps([task, n_splits, model_kwargs, n_estimators], sort_keys=True, default=repr).encode("utf-8"))
+    for name in sorted(arrays):
+        for array in arrays[name]:
+            h.update(("%s %s %s" % (name, array.dtype.str, array.shape)).encode("utf-8"))
+            h.update(array.tobytes())
+    return h.hexdigest()[:8]
+
+
+def zoo_experiment(datasets, models, store, task="classification", n_splits=5, seeds=(0,), model_kwargs=None,
+                   base_name="zoo", n_estimators=None):
+    """
+    Build an experiment cross-validating predictors of the zoo on a set of datasets
+
+    The datasets are stored once in the store as .npy files, which the trials open as read-only memory maps, so
+    parallel runs share them instead of receiving a copy.
+
+    Args:
+        datasets (dict): A mapping of dataset names to (X, y) pairs of arrays.
+        models (list of str): Names of the predictors to use (keys of classifiers or regressors).
+        store (str): A path to store the results and the datasets.
+        task (str): Either "classification" or "regression".
+        n_splits (int): Number of folds of the cross-validation.
+        seeds (list of int): Seeds used to shuffle the folds and to initialize the predictors.
+        model_kwargs (dict): A mapping of model names to additional kwargs used to build them.
+        base_name (str): Prefix for the file names of the trials, followed by a digest of the datasets, task,
+                         n_splits, model_kwargs and n_estimators, so results of other configurations are not reused.
+        n_estimators (list of int): If given, values of n_estimators to evaluate, added as the first variable, largest
+                                    first. Ensembles supporting warm_start (random-forest, extra-trees,
+                                    gradient-boosting) are grown up to the value of the trial in a single fit, storing
+                                    the smaller values as their own trials, so fit_seconds is cumulative. Predictors
+                                    without this parameter are fit once, sharing the results. Since the largest values
+                                    of all the fits are run first, the smaller ones are usually available when reached.
+
+    Returns:
+        Experiment: An experiment whose variables are model, dataset, fold and seed (preceded by n_estimators, if
+                    given). Results include the metrics of the predictions (see get_classification_metrics and
+                    get_regression_metrics) and the times spent fitting (fit_seconds) and predicting (predict_seconds).
+
+    """
+    import numpy as np
+    from .base import Experiment, ensure_dir_exists
+
+    if task not in ["classification", "regression"]:
+        raise ValueError("Invalid task. Available options are: 'classification', 'regression'.")
+    registry = classifiers if task == "classification" else regressors
+    for model in models:
+        if model not in registry:
+            raise ValueError("Unknown model %s. Available options are: %s." % (model, ", ".join(registry)))
+
+    dataset_path = os.path.join(store, "%s-datasets" % base_name)
+    ensure_dir_exists(dataset_path)
+    model_kwargs = model_kwargs if model_kwargs is not None else {}
+    if n_estimators is not None:
+        n_estimators = sorted(int(value) for value in n_estimators)
+    arrays = {name: (np.ascontiguousarray(X), np.ascontiguousarray(y)) for name, (X, y) in datasets.items()}
+    paths = {}
+    classes = {}
+    for name, (X, y) in arrays.items():
+        paths[name] = (os.path.abspath(os.path.join(dataset_path, "%s-X.npy" % name)),
+                       os.path.abspath(os.path.join(dataset_path, "%s-y.npy" % name)))
+        _store_array(paths[name][0], X)
+        _store_array(paths[name][1], y)
+        if task == "classification":
+            classes[name] = np.unique(y).tolist()
+
+    f = _ZooTrial(paths, classes, task, n_splits, model_kwargs, n_estimators=n_estimators)
+    variables = [("model", list(models)),
+                 ("dataset", list(datasets)),
+                 ("fold", list(range(n_splits))),
+                 ("seed", list(seeds))]
+    if n_estimators is not None:
+        # Largest first, so siblings running in parallel are rare: the smaller values are stored by then
+        variables.insert(0, ("n_estimators", sorted(n_estimators, reverse=True)))
+    digest = _zoo_digest(arrays, task, n_splits, model_kwargs, n_estimators)
+    experiment = Experiment(variables, f, store, base_name="%s-%s" % (base_name, digest))
+    f.experiment = experiment
+    return experiment
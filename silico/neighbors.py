@@ -0,0 +1,63 @@
+"""Nearest-neighbor search over a growing set of grid points"""
+
+
+class NeighborIndex:
+    """
+    Index of points allowing insertions and nearest-neighbor queries
+
+    Points are kept in k-d trees whose sizes are distinct powers of two (the logarithmic method), so an insertion
+    merges the smallest trees, amortizing to O(log^2 n), and a query searches O(log n) trees.
+    """
+
+    def __init__(self, p=2):
+        """
+
+        Args:
+            p (int): The p-norm used as distance (defaults to 2=euclidean).
+
+        """
+        self.p = p
+        self._levels = []  # (points, payloads, tree), by decreasing size
+
+    def __len__(self):
+        return sum(len(points) for points, _, _ in self._levels)
+
+    def add(self, point, payload):
+        """
+        Add a point to the index
+
+        Args:
+            point (tuple of float): Coordinates of the point.
+            payload: An object returned by the queries when this point is found.
+
+        """
+        from scipy.spatial import cKDTree
+
+        points = [tuple(point)]
+        payloads = [payload]
+        while self._levels and len(self._levels[-1][0]) <= len(points):
+            level_points, level_payloads, _ = self._levels.pop()
+            points = level_points + points
+            payloads = level_payloads + payloads
+        self._levels.append((points, payloads, cKDTree(points)))
+
+    def nearest(self, point, k=1):
+        """
+        Find the nearest points
+
+        Args:
+            point (tuple of float): Coordinates of the query point.
+            k (int): Maximum number of points to find.
+
+        Returns:
+            list: Payloads of the (at most k) nearest points, closest first.
+
+        """
+        candidates = []
+        for points, payloads, tree in self._levels:
+            distances, indices = tree.query(point, k=min(k, len(points)), p=self.p)
+            if min(k, len(points)) == 1:
+                distances, indices = [distances], [indices]
+            candidates.extend(zip(distances, indices, [payloads] * len(indices)))
+        candidates.sort(key=lambda c: c[0])
+        return [payloads[i] for _, i, payloads in candidates[:k]]
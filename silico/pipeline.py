@@ -0,0 +1,202 @@
+"""Experiments using the results of the trials of other experiments"""
+
+from collections import deque
+
+from .base import tqdm
+
+# Given by next when no task is left
+_NO_MORE_TASKS = object()
+
+
+class _Scheduler:
+    """Tracks the trials of a pipeline, releasing them when the trials providing their inputs finish"""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.tasks = {}  # (stage, file name) -> task
+        self.waiting = {}  # (stage, file name) -> keys of the trials waiting for it
+        self.missing = {}  # (stage, file name) -> number of inputs not finished yet
+        self.finished = set()
+        self.ready = deque()
+        self.in_flight = 0
+        for stage, (experiment, _) in enumerate(pipeline.stages):
+            for kwargs in experiment.iter_values():
+                self._schedule(stage, kwargs)
+
+    def _key(self, stage, kwargs):
+        return stage, self.pipeline.stages[stage][0]._trial(kwargs).get_file_name()
+
+    def _schedule(self, stage, kwargs):
+        """Add a trial, and the trials providing its inputs, unless already added or available"""
+        key = self._key(stage, kwargs)
+        if key in self.tasks or key in self.finished:
+            return key
+        experiment, inputs = self.pipeline.stages[stage]
+        if experiment._trial(kwargs).is_available():
+            self.finished.add(key)
+            return key
+        references = {}
+        missing = 0
+        for arg, (input_stage, mapping) in inputs.items():
+            input_kwargs = self.pipeline._input_kwargs(input_stage, mapping, kwargs)
+            input_key = self._schedule(input_stage, input_kwargs)
+            references[arg] = (input_stage, input_kwargs)
+            if input_key not in self.finished:
+                self.waiting.setdefault(input_key, []).append(key)
+                missing += 1
+        self.tasks[key] = (stage, kwargs, {"inputs": references} if references else {})
+        if missing:
+            self.missing[key] = missing
+        else:
+            self.ready.append(key)
+        return key
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def iter_tasks(self):
+        """Iterate the tasks as they are ready, giving None when none is until a running one finishes"""
+        while self.ready or self.in_flight:
+            if self.ready:
+                key = self.ready.popleft()
+                stage, kwargs, options = self.tasks[key]
+                if key in self.waiting and self.pipeline.stages[stage][0].write_behind:
+                    # Store the result before releasing the trials using it, which may run in other processes
+                    options = {**options, "flush": True}
+                self.in_flight += 1
+                yield stage, kwargs, options
+            else:
+                yield None
+
+    def finish(self, task):
+        """Mark a task as finished (including errors), releasing the trials waiting for it"""
+        stage, kwargs, _ = task
+        key = self._key(stage, kwargs)
+        self.in_flight -= 1
+        self.finished.add(key)
+        for waiting in self.waiting.pop(key, []):
+            self.missing[waiting] -= 1
+            if not self.missing[waiting]:
+                del self.missing[waiting]
+                self.ready.append(waiting)
+
+
+class Pipeline:
+    """
+    A sequence of experiments whose trials receive the results of trials of the previous ones
+
+    Trials are started as soon as the trials providing their inputs finish, sharing the workers, instead of waiting
+    for whole experiments. Available results (of any stage) are reused, as in Experiment.run_all.
+    """
+
+    def __init__(self):
+        self.stages = []  # (experiment, {arg: (stage, mapping)})
+
+    def add(self, experiment, inputs=None):
+        """
+        Add an experiment to the pipeline
+
+        Args:
+            experiment (Experiment): The experiment.
+            inputs (dict): A mapping of names of arguments of the function of the experiment to (experiment, mapping)
+                           tuples, where the experiment was previously added and the mapping gives the kwargs of its
+                           trial providing the result. The mapping can be a callable on the kwargs of the trial, a
+                           dict of variable names of the previous experiment to variable names of this one, or None to
+                           use the variables with the same names. The arguments are not part of the hash of the trials.
+
+        Returns:
+            Experiment: The experiment.
+
+        """
+        resolved = {}
+        for arg, (input_experiment, mapping) in (inputs or {}).items():
+            stages = [i for i, (e, _) in enumerate(self.stages) if e is input_experiment]
+            if not stages:
+                raise ValueError("The experiment providing %s must be added to the pipeline first" % arg)
+            resolved[arg] = (stages[0], mapping)
+        self.stages.append((experiment, resolved))
+        return experiment
+
+    def _input_kwargs(self, stage, mapping, kwargs):
+        """Get the kwargs of the trial of a stage providing an input to the trial with the given kwargs"""
+        if callable(mapping):
+            return mapping(kwargs)
+        if mapping is None:
+            mapping = {v.name: v.name for v in self.stages[stage][0].variables}
+        return {name: kwargs[input_name] for name, input_name in mapping.items()}
+
+    def _run_task(self, task):
+        """Run a task in the current process, returning the seconds spent"""
+        stage, kwargs, options = task
+        if "inputs" in options:
+            options = {**options, "inputs": {arg: self.stages[i][0]._trial(input_kwargs)
+                                             for arg, (i, input_kwargs) in options["inputs"].items()}}
+        return self.stages[stage][0]._run_trial(kwargs, **options)
+
+    def _iter_sequential(self, tasks):
+        for task in tasks:
+            yield task, self._run_task(task)
+
+    def _iter_threaded(self, tasks, threads):
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+        running = {}
+        exhausted = False
+        with ThreadPoolExecutor(threads) as executor:
+            while True:
+                while not exhausted and len(running) < threads:
+                    task = next(tasks, _NO_MORE_TASKS)
+                    if task is _NO_MORE_TASKS:
+                        exhausted = True
+                    elif task is None:  # Wait for the running ones
+                        break
+                    else:
+                        running[executor.submit(self._run_task, task)] = task
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield running.pop(future), future.result()
+
+    def run(self, method="sequential", threads=2, timeout=None):
+        """
+        Run all the trials of the experiments. If already run, kept.
+
+        Args:
+            method (str): How to run the trials. Available options are:
+                          - "sequential": One after another in the current process.
+                          - "threading": In parallel, using a pool of threads.
+                          - "multithreading": In parallel, using a pool of processes.
+            threads (int): Number of threads or processes to use if running in parallel.
+            timeout (float): Maximum number of seconds a trial can run (see Experiment.run_all). The trials using
+                             its result store an error.
+
+        """
+        method = method.lower()
+        if method not in ["sequential", "threading", "multithreading"]:
+            raise ValueError("Invalid method")
+        if method == "threading" and timeout is not None:
+            raise ValueError("Threads cannot be stopped, so timeout requires a process-based method")
+        if (method == "multithreading" or timeout is not None) and any(e._memory is not None for e, _ in self.stages):
+            raise ValueError("Results kept in memory are not shared with other processes, so use a thread-based method")
+
+        scheduler = _Scheduler(self)
+        tasks = scheduler.iter_tasks()
+        if method == "multithreading" or timeout is not None:
+            from .executor import ProcessExecutor
+            executor = ProcessExecutor([experiment for experiment, _ in self.stages],
+                                       threads if method == "multithreading" else 1, timeout=timeout)
+            runner = executor.run(tasks)
+        elif method == "sequential":
+            runner = self._iter_sequential(tasks)
+        else:
+            runner = self._iter_threaded(tasks, threads)
+
+        try:
+            for task, _ in tqdm(runner, total=len(scheduler)):
+                scheduler.finish(task)
+        finally:
+            runner.close()
+            for experiment, _ in self.stages:
+                experiment._teardown_contexts()
+                experiment._flush_results()
@@ -0,0 +1,229 @@
+"""Storage of the results of the trials in memory, before (or instead of) writing them to their files"""
+
+import atexit
+import os
+import pickle
+import signal
+import threading
+from collections import OrderedDict
+
+# Signals whose default action terminates the process without cleanup
+_TERMINATION_SIGNALS = [getattr(signal, name) for name in ["SIGTERM", "SIGHUP"] if hasattr(signal, name)]
+
+
+def _write_file(path, data):
+    """Write the data to a file atomically"""
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class BatchWriter:
+    """
+    Writer collecting the results of the trials in memory and storing them in batches from a background thread
+
+    Results are pickled when collected, so they are stored as they were when the trial finished. Pending results are
+    available to the readers of the process through get. They are flushed when the process exits normally (see
+    flush_on_signals to also do it on termination signals), but they are lost if it is killed.
+
+    Each result is still written to its own file, through a temporary file which is renamed, so the number of file
+    system operations is not reduced. The gain is taking them out of the trials, overlapping them with the following
+    ones, and writing only the last result of a path stored several times while pending.
+    """
+
+    def __init__(self, batch_size=256, interval=0.5):
+        """
+
+        Args:
+            batch_size (int): Number of pending results which triggers a write.
+            interval (float): Maximum number of seconds a result is pending before being written.
+
+        """
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pid = os.getpid()
+        self._pending = {}  # Pickled results by path
+        self._writing = {}  # Results being written, still visible to readers
+        self._condition = threading.Condition()
+        # Held while taking and writing a batch, so batches are written one at a time, in order
+        self._write_lock = threading.Lock()
+        self._thread = None
+
+    def _start(self):
+        """Start the writing thread and the flushing on exit, if not done yet. Must hold the condition."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="silico-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._pending) >= self.batch_size, timeout=self.interval)
+            self._write_batch()
+
+    def _write_batch(self):
+        """Write the pending results, after any batch being written (e.g., by the thread while flushing)"""
+        with self._write_lock:
+            with self._condition:
+                batch, self._pending = self._pending, {}
+                self._writing.update(batch)
+            try:
+                for path, data in batch.items():
+                    _write_file(path, data)
+            finally:
+                with self._condition:
+                    for path, data in batch.items():
+                        if self._writing.get(path) is data:
+                            del self._writing[path]
+                    self._condition.notify_all()
+
+    def put(self, path, result):
+        """Collect a result to be stored in the given path"""
+        data = pickle.dumps(result)
+        with self._condition:
+            self._start()
+            self._pending[path] = data
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify_all()
+
+    def get(self, path):
+        """Get the pending result to be stored in the path, or None if there is none"""
+        with self._condition:
+            data = self._pending.get(path, self._writing.get(path))
+        return None if data is None else pickle.loads(data)
+
+    def contains(self, path):
+        """Check if a result is pending to be stored in the path"""
+        with self._condition:
+            return path in self._pending or path in self._writing
+
+    def discard(self, path):
+        """Drop the pending result of the path, waiting for it if being written"""
+        with self._condition:
+            self._pending.pop(path, None)
+            self._condition.wait_for(lambda: path not in self._writing)
+
+    def flush(self):
+        """Write all the pending results, returning when they are stored"""
+        self._write_batch()
+        with self._condition:
+            self._condition.wait_for(lambda: not self._writing)
+
+
+def _exit_on_signal(signum, frame):
+    # Not flushing here, since the interrupted code might hold the locks of the writers
+    raise SystemExit(128 + signum)
+
+
+def flush_on_signals(signals=None):
+    """
+    Exit normally when receiving termination signals, so the results pending in the writers are flushed
+
+    Writers only flush when the process exits normally, which termination signals skip by default. This replaces the
+    handlers of the signals by one raising SystemExit, so the exit handlers run once the main thread unwinds. Since it
+    changes the handling of the signals of the whole process, it is left for applications to opt in.
+
+    Args:
+        signals (list of int): The signals to handle. If None, SIGTERM and SIGHUP (if available in the platform).
+
+    """
+    for signum in signals if signals is not None else _TERMINATION_SIGNALS:
+        signal.signal(signum, _exit_on_signal)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Get the writer of the current process, creating it if needed"""
+    global _writer
+    with _writer_lock:
+        # A forked process gets a copy of the parent's writer, but not its thread
+        if _writer is None or _writer.pid != os.getpid():
+            _writer = BatchWriter()
+        return _writer
+
+
+class MemoryStore:
+    """
+    Storage of the results of the trials in memory, writing them to their files only when exceeding a size (the least
+    recently used ones first) or when persisted
+
+    It is used as a BatchWriter, but it belongs to an experiment rather than to a process, so it is not available to
+    other processes.
+    """
+
+    def __init__(self, max_bytes=None):
+        """
+
+        Args:
+            max_bytes (int): Maximum size of the pickled results kept in memory. If None, they are never written.
+
+        """
+        self.max_bytes = max_bytes
+        self._results = OrderedDict()  # Pickled results by path, least recently used first
+        self._size = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def put(self, path, result):
+        """Keep a result to be stored in the given path, writing the least recently used ones if exceeding the size"""
+        data = pickle.dumps(result)
+        with self._lock:
+            self._pop(path)
+            self._results[path] = data
+            self._size += len(data)
+            while self.max_bytes is not None and self._size > self.max_bytes and self._results:
+                spilled_path, spilled = self._results.popitem(last=False)
+                self._size -= len(spilled)
+                _write_file(spilled_path, spilled)
+
+    def _pop(self, path):
+        data = self._results.pop(path, None)
+        if data is not None:
+            self._size -= len(data)
+        return data
+
+    def get(self, path):
+        """Get the result kept for the path, or None if there is none"""
+        with self._lock:
+            data = self._results.get(path)
+            if data is None:
+                return None
+            self._results.move_to_end(path)
+        return pickle.loads(data)
+
+    def contains(self, path):
+        """Check if a result is kept for the path"""
+        with self._lock:
+            return path in self._results
+
+    def paths(self):
+        """Get the paths of the results kept"""
+        with self._lock:
+            return list(self._results)
+
+    def discard(self, path):
+        """Drop the result kept for the path"""
+        with self._lock:
+            self._pop(path)
+
+    def clear(self):
+        """Drop all the results"""
+        with self._lock:
+            self._results.clear()
+            self._size = 0
+
+    def flush(self):
+        """Write all the results to their files, removing them from memory"""
+        with self._lock:
+            while self._results:
+                path, data = self._results.popitem(last=False)
+                self._size -= len(data)
+                _write_file(path, data)
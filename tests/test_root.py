@@ -1,6 +1,10 @@
+import os
+import pickle
+
 from numpy import random
 
 from silico import Experiment
+from silico.base import GridVariable, Variable
 
 
 def experiment_f(mean, sigma, seed):
@@ -61,3 +65,939 @@ def test_error():
     assert len(df) == 45
     assert "_error" in df.columns
     experiment.invalidate()
+
+
+def sleeping_f(duration):
+    import time
+    time.sleep(duration)
+    return {"duration": duration}
+
+
+def test_timeout():
+    """Test trials exceeding their time limit are killed and stored as errors"""
+    experiment = Experiment([("duration", [0, 0.01, 30])], sleeping_f, "test-data", "sleeping")
+    experiment.invalidate()
+    experiment.run_all(method="multithreading", threads=2, timeout=1)
+    assert experiment.status() == {"total": 3, "done": 3, "errors": 1}
+    df = experiment.get_results_df(skip_errors=False)
+    assert df.loc[30, "_error"].startswith("Timeout")
+    assert df.loc[30, "_elapsed_seconds"] >= 1
+    experiment.invalidate()
+
+
+def test_time_budget():
+    """Test no new trials are started when the time budget is exhausted"""
+    # Once a trial finishes, the elapsed time and the mean duration add up to at least 2 s, clearly exceeding the
+    # budget, while the first trials are started well within it
+    experiment = Experiment([("duration", [1, 1.01, 1.02, 1.03])], sleeping_f, "test-data", "sleeping")
+    experiment.invalidate()
+    experiment.run_all(time_budget=1.5)
+    assert experiment.status()["done"] == 1
+    experiment.run_all(method="multithreading", threads=2, time_budget=1.5)
+    assert experiment.status()["done"] == 3
+    experiment.invalidate()
+
+
+def _imported_modules(statement):
+    """Names of the modules imported when running a statement in a fresh interpreter"""
+    import subprocess
+    import sys
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], capture_output=True, text=True,
+                         check=True)
+    return {line.rsplit("|", 1)[-1].strip() for line in out.stderr.splitlines() if line.startswith("import time:")}
+
+
+def test_lazy_imports():
+    """Test heavy dependencies are not imported by the CLI or the predictor mappings"""
+    heavy = {"pandas", "scipy", "sklearn", "tqdm"}
+    for statement in ["import silico.cli", "import silico.ml; silico.ml.classifiers, silico.ml.regressors",
+                      "import silico.metrics"]:
+        modules = _imported_modules(statement)
+        assert not {m.split(".")[0] for m in modules} & heavy, statement
+
+    modules = _imported_modules("import silico.ml; silico.ml.classifiers['k-neighbors']")
+    assert any(m.startswith("sklearn.neighbors") for m in modules)
+    assert not any(m.startswith("sklearn.ensemble") for m in modules)
+
+    # Lazy names are still exported
+    namespace = {}
+    exec("from silico import *", namespace)
+    assert {"Experiment", "paired_t_test", "df_agg_mean", "get_classification_metrics", "plot_confusion_matrix",
+            "highlight_max", "highlight_threshold"} <= set(namespace)
+
+    # The mappings of predictors can be extended
+    from silico.ml import classifiers
+    classifiers["mine"] = dict
+    assert classifiers["mine"] is dict and "mine" in list(classifiers)
+    del classifiers["mine"]
+    assert "mine" not in classifiers
+
+
+def test_zoo(tmp_path):
+    """Test cross-validating predictors of the zoo in parallel"""
+    from silico.ml import zoo_experiment
+    random.seed(0)
+    X = random.normal(size=(60, 3))
+    y = (X[:, 0] > 0).astype(int)
+    experiment = zoo_experiment({"blobs": (X, y), "noise": (X, random.randint(0, 3, 60))},
+                                ["k-neighbors", "logistic"], str(tmp_path), n_splits=3, seeds=[0, 1])
+    assert len(experiment) == 24
+    experiment.run_all(method="multithreading", threads=2)
+    assert experiment.status() == {"total": 24, "done": 24, "errors": 0}
+    df = experiment.get_results_df()
+    assert {"Accuracy", "F1", "fit_seconds", "predict_seconds"} <= set(df.columns)
+    assert df.loc[("logistic", "blobs"), "Accuracy"].mean() > 0.8
+
+
+def _log_line(path, line):
+    with open(path, "a") as f:
+        f.write(line + "\n")
+
+
+def counting_setup(path):
+    _log_line(path, "setup")
+    return {"offset": 100}
+
+
+def counting_teardown(path, context):
+    _log_line(path, "teardown")
+
+
+def context_f(x, context):
+    return {"value": x + context["offset"]}
+
+
+def closing_teardown(context):
+    context["closed"] = True
+
+
+def checking_f(x, context):
+    import time
+    time.sleep(0.2)
+    if context.get("closed"):
+        raise RuntimeError("Context used after its teardown")
+    return {"value": x}
+
+
+def test_context(tmp_path):
+    """Test the context is built once per worker and not hashed"""
+    import time
+    from functools import partial
+    log = str(tmp_path / "log.txt")
+    for method in ["sequential", "threading", "multithreading"]:
+        experiment = Experiment([("x", list(range(10)))], context_f, str(tmp_path / method),
+                                setup=partial(counting_setup, log), teardown=partial(counting_teardown, log))
+        experiment.run_all(method=method, threads=2)
+        df = experiment.get_results_df()
+        assert list(df["value"]) == list(range(100, 110))
+        with open(log) as f:
+            lines = f.read().split()
+        assert 1 <= lines.count("setup") <= (1 if method == "sequential" else 2)
+        assert lines.count("setup") == lines.count("teardown")
+        os.remove(log)
+    # Running a single trial also tears its context down
+    assert experiment.get_result({"x": 20})["value"] == 120
+    with open(log) as f:
+        assert f.read().split() == ["setup", "teardown"]
+    # Without tearing down those of the trials running meanwhile
+    experiment = Experiment([("x", list(range(4)))], checking_f, str(tmp_path / "background"), setup=dict,
+                            teardown=closing_teardown)
+    handle = experiment.run_all(method="threading", threads=2, background=True)
+    time.sleep(0.05)
+    assert experiment.get_result({"x": 100})["value"] == 100
+    handle.wait()
+    assert experiment.status() == {"total": 4, "done": 4, "errors": 0}
+    # The context does not take part in the hash
+    assert os.path.exists(os.path.join(experiment.store, experiment._trial({"x": 0}).get_file_name()))
+
+
+def test_classification_metrics():
+    """Test the metrics derived from the confusion matrix match those of sklearn"""
+    import numpy as np
+    from sklearn import metrics
+    from silico.metrics import get_classification_metrics, get_classification_metrics_batch
+
+    random.seed(0)
+    y = random.randint(0, 3, 100)
+    predictions = random.randint(0, 4, (5, 100))
+    batch = get_classification_metrics_batch(y, predictions, classes=[0, 1, 2])
+    for i, p in enumerate(predictions):
+        single = get_classification_metrics(y, p, classes=[0, 1, 2])
+        assert np.isclose(single["Accuracy"], metrics.accuracy_score(y, p))
+        assert np.isclose(single["Cohen kappa"], metrics.cohen_kappa_score(y, p))
+        assert np.isclose(single["Matthews Phi"], metrics.matthews_corrcoef(y, p))
+        for name, f in [("Precision", metrics.precision_score), ("Recall", metrics.recall_score),
+                        ("F1", metrics.f1_score)]:
+            for criterium in ["micro", "macro", "weighted"]:
+                expected = f(y, p, average=criterium, zero_division=0)
+                assert np.isclose(single[name][criterium], expected)
+                assert np.isclose(batch[name][criterium][i], expected)
+            assert np.allclose(single[name]["target"], f(y, p, average=None, labels=[0, 1, 2], zero_division=0))
+    assert np.isnan(get_classification_metrics([0.5, 1.5], [0, 1])["Accuracy"])
+
+
+def test_paired_t_test():
+    """Test the vectorized paired t-test matches scipy"""
+    import numpy as np
+    import pandas as pd
+    from scipy.stats import ttest_rel
+    from silico import paired_t_test
+
+    random.seed(0)
+    df = pd.DataFrame([{"method": m, "size": s, "seed": seed, "left": random.normal(), "right": random.normal(0.5)}
+                       for m in ["a", "b"] for s in [10, 20] for seed in range(8)]).set_index(["method", "size", "seed"])
+    out = paired_t_test(df, "left", "right")
+    assert len(out) == 4
+    for (m, s), row in out.iterrows():
+        group = df.loc[(m, s)]
+        assert np.isclose(row["p-value-less"], ttest_rel(group["left"], group["right"], alternative="less").pvalue)
+        assert np.isclose(row["p-value-greater"],
+                          ttest_rel(group["left"], group["right"], alternative="greater").pvalue)
+    # Single level index
+    single = paired_t_test(df.loc[("a", 10)], "left", "right")
+    assert np.isclose(single["p-value-less"].iloc[0], out.loc[("a", 10), "p-value-less"])
+
+
+def test_df_agg_bootstrap():
+    """Test the bootstrap confidence intervals"""
+    import numpy as np
+    import pandas as pd
+    from silico import df_agg_bootstrap
+
+    random.seed(0)
+    df = pd.DataFrame({"group": random.randint(0, 10, 1000), "value": random.normal(size=1000)})
+    df_ci = df_agg_bootstrap(df, ["group"], seed=0, raw=True)
+    means = df.groupby("group")["value"].mean()
+    assert np.allclose(df_ci[("value", "mean")], means)
+    assert (df_ci[("value", "low")] < means).all() and (means < df_ci[("value", "high")]).all()
+    # Half-width close to the normal approximation
+    sem = df.groupby("group")["value"].sem()
+    assert np.allclose(df_ci[("value", "err")], 1.96 * sem, rtol=0.2)
+    # Independent of the number of processes
+    assert df_ci.equals(df_agg_bootstrap(df, ["group"], seed=0, raw=True, processes=2))
+    assert df_agg_bootstrap(df, ["group"], seed=0).shape == (10, 1)
+
+
+def test_format_mag_err_array():
+    """Test the vectorized formatting matches format_mag_err"""
+    import numpy as np
+    from silico import format_mag_err, format_mag_err_array
+
+    random.seed(0)
+    mag = random.normal(size=2000) * 10.0 ** random.randint(-6, 6, 2000)
+    err = abs(random.normal(size=2000)) * 10.0 ** random.randint(-6, 6, 2000)
+    err[::20] = 0
+    err[::30] = np.nan
+    err[::7] = 10.0 ** random.randint(-6, 6, len(err[::7]))
+    for increase in [-1, 0, 1]:
+        for increase_ones in [True, False]:
+            assert list(format_mag_err_array(mag, err, increase=increase, increase_ones=increase_ones)) == [
+                format_mag_err(m, e, increase=increase, increase_ones=increase_ones) for m, e in zip(mag, err)]
+
+
+def test_aggregate():
+    """Test the streaming aggregation matches aggregating the results dataframe"""
+    import numpy as np
+    from silico import df_agg_mean
+
+    experiment = Experiment(
+        [
+            ("mean", [1, 2, 4]),
+            ("sigma", [1, 2, 3]),
+            ("seed", list(range(10))),
+        ],
+        experiment_f,
+        "test-data",
+    )
+    experiment.invalidate()
+    experiment.run_all()
+    expected = df_agg_mean(experiment.get_results_df()[["value"]], ["mean", "sigma"], raw=True)
+    for processes in [None, 2]:
+        df = experiment.aggregate(["mean", "sigma"], columns=["value"], processes=processes)
+        assert np.allclose(df[expected.columns], expected)
+        assert (df[("value", "count")] == 10).all()
+    assert experiment.aggregate(["mean"]).shape == (3, 10)
+    experiment.invalidate()
+
+
+def test_export(tmp_path):
+    """Test exporting the results in chunks"""
+    import numpy as np
+    import pandas as pd
+    from silico.export import write_results
+
+    experiment = Experiment([("mean", [1, 2, 4]), ("sigma", [1]), ("seed", list(range(5)))], experiment_f,
+                            str(tmp_path))
+    experiment.run_all()
+    df = experiment.get_results_df()
+    assert len(list(experiment.iter_results_df(chunk_size=4))) == 4
+
+    assert write_results(experiment, str(tmp_path / "out.csv"), chunk_size=4) == 15
+    df_csv = pd.read_csv(str(tmp_path / "out.csv"), index_col=[0, 1, 2])
+    assert np.allclose(df_csv["value"], df["value"])
+    for extension, reader in [("parquet", pd.read_parquet), ("feather", pd.read_feather)]:
+        try:
+            write_results(experiment, str(tmp_path / ("out." + extension)), chunk_size=4)
+        except ModuleNotFoundError:  # pyarrow not available
+            continue
+        df_read = reader(str(tmp_path / ("out." + extension)))
+        assert df_read.index.names == ["mean", "sigma", "seed"]
+        assert df_read["value"].equals(df["value"])
+
+    # Without results, a file with the index only
+    empty = Experiment([("mean", [1, 2, 4]), ("sigma", [1]), ("seed", list(range(5)))], experiment_f,
+                       str(tmp_path / "empty"))
+    readers = [("csv", lambda path: pd.read_csv(path, index_col=[0, 1, 2])), ("parquet", pd.read_parquet),
+               ("feather", pd.read_feather)]
+    for extension, reader in readers:
+        output = str(tmp_path / ("empty." + extension))
+        try:
+            assert write_results(empty, output) == 0
+        except ModuleNotFoundError:  # pyarrow not available
+            continue
+        df_read = reader(output)
+        assert len(df_read) == 0 and df_read.index.names == ["mean", "sigma", "seed"]
+
+
+def late_columns_f(x):
+    return {"value": None if x < 4 else x / 2, **({"late": x} if x >= 6 else {})}
+
+
+def test_export_late_columns(tmp_path):
+    """Test exporting results whose columns or types differ from those of the first chunk"""
+    import numpy as np
+    import pandas as pd
+    from silico.export import write_results
+
+    experiment = Experiment([("x", list(range(8)))], late_columns_f, str(tmp_path / "data"))
+    experiment.run_all()
+    expected = experiment.get_results_df()
+    readers = [("csv", lambda path: pd.read_csv(path, index_col=0)), ("parquet", pd.read_parquet),
+               ("feather", pd.read_feather)]
+    for extension, reader in readers:
+        output = str(tmp_path / ("out." + extension))
+        try:
+            assert write_results(experiment, output, chunk_size=3) == 8
+        except ModuleNotFoundError:  # pyarrow not available
+            continue
+        df = reader(output)
+        assert list(df.columns) == list(expected.columns)
+        assert np.allclose(df["value"].astype(float), expected["value"].astype(float), equal_nan=True)
+        assert np.allclose(df["late"], expected["late"], equal_nan=True)
+    assert sorted(os.listdir(str(tmp_path))) == sorted(["data"] + ["out." + e for e, _ in readers])
+
+    # Failures leave no partial output
+    def failing_chunks(*args, **kwargs):
+        yield next(Experiment.iter_results_df(experiment, *args, **kwargs))
+        raise RuntimeError("Failed reading the results")
+
+    experiment.iter_results_df = failing_chunks
+    try:
+        write_results(experiment, str(tmp_path / "failed.csv"), chunk_size=3)
+        assert False, "Not failed"
+    except RuntimeError:
+        pass
+    assert not [name for name in os.listdir(str(tmp_path)) if name.startswith("failed")]
+
+
+def test_results_dtypes():
+    """Test the options defining the types of the results dataframe"""
+    experiment = Experiment([("mean", [1, 2, 4]), ("sigma", [1, 2]), ("seed", list(range(3)))], experiment_f,
+                            "test-data")
+    experiment.invalidate()
+    experiment.run_all()
+    df = experiment.get_results_df()
+    df_compact = experiment.get_results_df(categorical=True, parse_dates=True, float32=True,
+                                           schema={"count": "Int64"})
+    assert list(df_compact.index.levels[0]) == [1, 2, 4]
+    assert df_compact.index.get_level_values("mean").dtype == "category"
+    assert str(df_compact["_run_start"].dtype).startswith("datetime64")
+    assert df_compact["value"].dtype == "float32"
+    assert df_compact["count"].isna().all()
+    assert (df_compact["value"] == df["value"].astype("float32")).all()
+    experiment.invalidate()
+
+
+class Preempted(BaseException):
+    pass
+
+
+def checkpointed_f(steps, checkpoint, preempt_at=None):
+    state = checkpoint.load(default={"step": 0, "starts": 0})
+    state["starts"] += 1
+    while state["step"] < steps:
+        if state["step"] == preempt_at:
+            raise Preempted()
+        state["step"] += 1
+        checkpoint.save(state)
+    return state
+
+
+def test_checkpoint():
+    """Test interrupted trials are resumed from their checkpoint"""
+    experiment = Experiment([("steps", [5])], checkpointed_f, "test-data", checkpoint_arg="checkpoint")
+    experiment.invalidate()
+    trial = experiment._trial({"steps": 5})
+    trial.extra_kwargs = {"preempt_at": 3}
+    try:
+        trial.load_or_run()
+        assert False, "Not preempted"
+    except Preempted:
+        pass
+    assert trial.get_checkpoint().load()["step"] == 3
+    assert experiment.status()["done"] == 0
+
+    experiment.run_all()
+    result = experiment.get_result({"steps": 5})
+    assert result["step"] == 5 and result["starts"] == 2
+    assert not trial.get_checkpoint().exists()
+    experiment.invalidate()
+
+
+def warm_f(x, y, warm_start):
+    return {"source": None if warm_start is None else (warm_start["x"], warm_start["y"]), "x": x, "y": y}
+
+
+def test_warm_start(tmp_path):
+    """Test trials receive the result of the nearest completed trial"""
+    experiment = Experiment([("x", list(range(6))), ("y", [0, 10])], warm_f, str(tmp_path), warm_start_arg="warm_start")
+    experiment.run_all()
+    df = experiment.get_results_df()
+    assert df.loc[(0, 0), "source"] is None
+    assert df.loc[(0, 10), "source"] == (0, 0)
+    assert df.loc[(3, 0), "source"] in [(2, 0), (2, 10)]
+
+    experiment = Experiment([("x", list(range(6))), ("y", [0, 10])], warm_f, str(tmp_path / "urinal"),
+                            strategy="urinal", warm_start_arg="warm_start")
+    experiment.run_all(method="multithreading", threads=2)
+    sources = experiment.get_results_df()["source"]
+    assert sources.isna().sum() <= 2  # Only the first ones to be dispatched lack a warm start
+
+
+def test_fingerprint(tmp_path):
+    """Test only results of outdated implementations or matching a predicate are invalidated"""
+    variables = [("mean", [1, 2]), ("sigma", [1]), ("seed", [0, 1])]
+    experiment = Experiment(variables, experiment_f, str(tmp_path), version="1")
+    experiment.run_all()
+    assert experiment.get_results_df()["_fingerprint"].nunique() == 1
+
+    experiment.invalidate(where=lambda kwargs: kwargs["mean"] == 1)
+    assert experiment.status()["done"] == 2
+    experiment.run_all()
+
+    updated = Experiment(variables, experiment_f, str(tmp_path), version="2")
+    updated._trial({"mean": 1, "sigma": 1, "seed": 0}).run_and_save()
+    updated.invalidate(stale_only=True)
+    assert updated.status()["done"] == 1
+    experiment.invalidate(stale_only=True)
+    assert experiment.status()["done"] == 0
+
+    # Without running information, no result would have a fingerprint
+    for kwargs in [{"version": "1"}, {"fingerprint": True}]:
+        try:
+            Experiment(variables, experiment_f, str(tmp_path), add_stats=False, **kwargs)
+            assert False, "Not raised"
+        except ValueError:
+            pass
+    plain = Experiment(variables, experiment_f, str(tmp_path), add_stats=False)
+    plain.run_all()
+    try:
+        plain.invalidate(stale_only=True)
+        assert False, "Not raised"
+    except ValueError:
+        pass
+    assert plain.status()["done"] == 4
+
+
+def flaky_f(x, fail_file):
+    if x == 1 and os.path.exists(fail_file):
+        raise RuntimeError("Transient error")
+    return {"x": x}
+
+
+def test_retry_errors(tmp_path):
+    """Test only errored trials are retried"""
+    fail_file = str(tmp_path / "fail")
+    open(fail_file, "w").close()
+    experiment = Experiment([("x", [0, 1, 2]), ("fail_file", [fail_file])], flaky_f, str(tmp_path))
+    experiment.run_all()
+    assert experiment.status()["errors"] == 1
+    assert [kwargs["x"] for kwargs, _ in experiment._errored_trials()] == [1]
+
+    experiment.run_all(retry_errors=True, max_retries=2)  # Still failing
+    assert experiment._errored_trials()[0][1] == 3
+    experiment.run_all(retry_errors=True, max_retries=2)  # No retries left
+    assert experiment._errored_trials()[0][1] == 3
+
+    os.remove(fail_file)
+    start = experiment.get_result({"x": 0, "fail_file": fail_file})["_run_start"]
+    experiment.run_all(retry_errors=True, max_retries=None, backoff=0.01)
+    assert experiment.status()["errors"] == 0
+    assert experiment.get_result({"x": 1, "fail_file": fail_file})["_attempts"] == 4
+    assert experiment.get_result({"x": 0, "fail_file": fail_file})["_run_start"] == start
+    assert not experiment._errored_trials()
+
+
+def failing_f(x, log):
+    _log_line(log, str(x))
+    raise RuntimeError("Persistent error")
+
+
+def test_retry_errors_parallel(tmp_path):
+    """Test errored trials are not retried again while still running in parallel"""
+    log = str(tmp_path / "log.txt")
+    for method in ["threading", "multithreading"]:
+        experiment = Experiment([("x", [0, 1]), ("log", [log])], failing_f, str(tmp_path / method))
+        experiment.run_all()
+        experiment.run_all(method=method, threads=4, retry_errors=True, max_retries=2)
+        with open(log) as f:
+            assert sorted(f.read().split()) == ["0", "0", "0", "1", "1", "1"]
+        assert [attempts for _, attempts in experiment._errored_trials()] == [3, 3]
+        os.remove(log)
+
+
+def threads_f(x):
+    from threadpoolctl import threadpool_info
+    return {"limits": sorted({pool["num_threads"] for pool in threadpool_info()}),
+            "omp": os.environ.get("OMP_NUM_THREADS")}
+
+
+def test_inner_threads(tmp_path):
+    """Test the native thread pools of the workers are limited"""
+    import numpy  # Ensure a BLAS pool is loaded
+
+    experiment = Experiment([("x", list(range(4)))], threads_f, str(tmp_path))
+    experiment.run_all(method="multithreading", threads=2, inner_threads=1)
+    df = experiment.get_results_df()
+    assert (df["_inner_threads"] == 1).all()
+    assert (df["omp"] == "1").all()
+    assert all(limits == [1] for limits in df["limits"] if limits)
+
+    previous = os.environ.get("OMP_NUM_THREADS")
+    experiment.invalidate()
+    experiment.run_all(inner_threads="auto")
+    assert (experiment.get_results_df()["_inner_threads"] >= 1).all()
+    assert os.environ.get("OMP_NUM_THREADS") == previous
+
+    # Threads split the CPUs too
+    from silico.common import available_cpus
+    experiment.invalidate()
+    experiment.run_all(method="threading", threads=2, inner_threads="auto")
+    assert (experiment.get_results_df()["_inner_threads"] == max(1, available_cpus() // 2)).all()
+
+
+def interval_f(size):
+    import time
+    start = time.time()
+    time.sleep(0.3)
+    return {"start": start, "end": time.time()}
+
+
+def test_memory_limit(tmp_path):
+    """Test trials are started only while their estimated memory fits"""
+    experiment = Experiment([("size", [1, 2, 10, 3, 4, 5])], interval_f, str(tmp_path))
+    experiment.run_all(method="multithreading", threads=3, memory_limit=10,
+                       memory_estimator=lambda kwargs: 10 if kwargs["size"] == 10 else 1)
+    df = experiment.get_results_df()
+    big = df.loc[10]
+    others = df.drop(10)
+    assert ((others["end"] <= big["start"]) | (others["start"] >= big["end"])).all()
+    assert (others["start"] < others["end"].min()).sum() > 1  # Small trials overlap among them
+
+    experiment.invalidate()
+    experiment.run_all(method="multithreading", threads=2, memory_limit=2 ** 40)
+    assert (experiment.get_results_df()["_peak_rss"] > 0).all()
+    # Available trials are skipped without an estimate
+    assert experiment._task_memory(lambda kwargs: 2 ** 40, {"size": 1}) == 0
+
+    # Trials without an estimate yet use the default one
+    experiment = Experiment([("size", list(range(4)))], interval_f, str(tmp_path / "default"))
+    experiment.run_all(method="multithreading", threads=2, memory_limit=10, memory_default=1)
+    df = experiment.get_results_df()
+    assert (df["start"] < df["end"].min()).sum() > 1
+
+
+def test_write_behind(tmp_path, monkeypatch):
+    """Test results collected in memory are readable and stored when the run finishes"""
+    variables = [("mean", [1, 2]), ("sigma", [1]), ("seed", list(range(50)))]
+    experiment = Experiment(variables, experiment_f, str(tmp_path), write_behind=True)
+    trial = experiment._trial({"mean": 1, "sigma": 1, "seed": 0})
+    trial.run_and_save()
+    assert trial.is_available() and trial.load()["value"] == experiment_f(1, 1, 0)["value"]
+
+    experiment.run_all()
+    assert len(list(tmp_path.glob("*.pkl"))) == 100
+    experiment.run_all(method="multithreading", threads=2)
+    df = Experiment(variables, experiment_f, str(tmp_path)).get_results_df()
+    assert len(df) == 100
+
+    experiment.invalidate()
+    experiment.run_all(method="multithreading", threads=2)
+    assert len(Experiment(variables, experiment_f, str(tmp_path)).get_results_df()) == 100
+
+    # Flushing while the thread writes the same path, with slow writes to overlap them
+    import time
+    import silico.writer
+    from silico.writer import BatchWriter
+
+    write_file = silico.writer._write_file
+    writing = []
+    overlapped = []
+
+    def slow_write_file(path, data):
+        writing.append(path)
+        overlapped.append(len(writing) > 1)
+        time.sleep(0.002)
+        write_file(path, data)
+        writing.remove(path)
+
+    monkeypatch.setattr(silico.writer, "_write_file", slow_write_file)
+    writer = BatchWriter(batch_size=1, interval=0.001)
+    path = str(tmp_path / "rewritten.pkl")
+    for i in range(100):
+        writer.put(path, i)
+        time.sleep(0.001)  # Let the thread take the result
+        if i % 3 == 0:
+            writer.flush()
+    writer.flush()
+    with open(path, "rb") as f:
+        assert pickle.load(f) == 99
+    assert overlapped and not any(overlapped)
+    assert writer._thread.is_alive()
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+_TERMINATED_WRITER = """
+import os, signal, sys, time
+sys.path[:0] = [%r, os.path.dirname(%r)]
+from silico import Experiment
+from silico.writer import get_writer, flush_on_signals
+from test_root import experiment_f
+
+assert signal.getsignal(signal.SIGTERM) == signal.SIG_DFL
+get_writer().interval = 60  # Only flushed when exiting
+experiment = Experiment([("mean", [1]), ("sigma", [1]), ("seed", [0])], experiment_f, %r, write_behind=True)
+experiment._trial({"mean": 1, "sigma": 1, "seed": 0}).run_and_save()
+assert signal.getsignal(signal.SIGTERM) == signal.SIG_DFL  # Not changed by the library
+flush_on_signals()
+os.kill(os.getpid(), signal.SIGTERM)
+time.sleep(30)
+"""
+
+
+def test_write_behind_signals(tmp_path):
+    """Test results written behind are flushed on termination signals if opted in"""
+    import signal
+    import subprocess
+    import sys
+
+    tests_dir = os.path.dirname(os.path.abspath(__file__))
+    script = _TERMINATED_WRITER % (tests_dir, tests_dir, str(tmp_path))
+    out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, timeout=60)
+    assert out.returncode == 128 + signal.SIGTERM, out.stderr
+    assert len(list(tmp_path.glob("*.pkl"))) == 1
+
+
+def test_background(tmp_path):
+    """Test runs in background report their progress and can be cancelled"""
+    experiment = Experiment([("size", list(range(40)))], interval_f, str(tmp_path))
+    handle = experiment.run_all(method="threading", threads=2, background=True)
+    assert handle.running()
+    while handle.progress()["done"] < 2:
+        assert handle.wait(0.05) is False
+    handle.cancel()
+    assert not handle.running()
+    done = handle.progress()["done"]
+    assert 2 <= done < 40 and handle.throughput > 0
+    assert len(handle.partial_results_df()) == experiment.status()["done"]
+
+    done = experiment.status()["done"]
+    handle = experiment.run_all(method="threading", threads=8, background=True)
+    assert handle.wait()
+    assert handle.progress()["ran"] == 40 - done
+    assert experiment.status()["done"] == 40
+
+
+def test_background_cancel(tmp_path):
+    """Test cancelling a run in background kills the trials running in processes"""
+    import time
+
+    experiment = Experiment([("duration", [30, 30, 30])], sleeping_f, str(tmp_path))
+    for options in [{}, {"timeout": 60}]:
+        handle = experiment.run_all(method="multithreading", threads=2, background=True, **options)
+        time.sleep(0.5)
+        start = time.monotonic()
+        assert handle.cancel(timeout=10)
+        assert time.monotonic() - start < 5
+        assert experiment.status()["done"] == 0
+
+    # Trials running in threads are finished, but no other is started
+    experiment = Experiment([("duration", [0.5, 0.51, 0.52])], sleeping_f, str(tmp_path / "sequential"))
+    handle = experiment.run_all(background=True)
+    time.sleep(0.1)
+    assert handle.cancel(timeout=10)
+    assert experiment.status()["done"] == 1
+
+
+def straggler_f(x, marker):
+    import time
+    if x == 5:
+        try:
+            open(marker, "x").close()
+            # The first attempt gets stuck while writing
+            open(os.path.join(os.path.dirname(marker), "partial.pkl.%d.tmp" % os.getpid()), "w").close()
+            time.sleep(30)
+            return {"copy": False}
+        except FileExistsError:
+            pass
+    time.sleep(0.1)
+    return {"copy": x == 5}
+
+
+def test_speculate(tmp_path):
+    """Test stragglers are run again in idle workers"""
+    import time
+
+    experiment = Experiment([("x", list(range(6))), ("marker", [str(tmp_path / "marker")])], straggler_f,
+                            str(tmp_path))
+    start = time.monotonic()
+    experiment.run_all(method="multithreading", threads=2, speculate=3)
+    assert time.monotonic() - start < 10
+    df = experiment.get_results_df()
+    assert len(df) == 6 and df["copy"].sum() == 1
+    assert not list(tmp_path.glob("*.tmp"))  # Removed when killing the straggler
+
+
+class IterableVariable(Variable):
+    """A variable only implementing iteration, without random access"""
+
+    def __init__(self, name, values):
+        super().__init__(name)
+        self.values = values
+
+    def iter_values(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+
+def test_lazy_variables(tmp_path):
+    """Test variables whose values are computed from their position"""
+    import numpy as np
+    from silico import RangeVariable, LinSpaceVariable, LogSpaceVariable
+
+    huge = LinSpaceVariable("x", 0.0, 1.0, 10 ** 12)
+    assert len(huge) == 10 ** 12 and huge[-1] == 1.0
+    assert huge.get_standard() == huge[5 * 10 ** 11]
+    assert huge.index_of(huge[123456789]) == 123456789
+
+    assert list(LinSpaceVariable("x", 1, 2, 5).iter_values()) == list(np.linspace(1, 2, 5))
+    assert list(LinSpaceVariable("x", 1, 2, 1).iter_values()) == list(np.linspace(1, 2, 1))
+    assert np.allclose(list(LogSpaceVariable("x", -3, 1, 9).iter_values()), np.logspace(-3, 1, 9))
+    assert np.allclose(list(LogSpaceVariable("x", -3, 1, 1).iter_values()), np.logspace(-3, 1, 1))
+
+    # Grids which are not sequences
+    experiment = Experiment([GridVariable("mean", {1, 2}), GridVariable("sigma", {1: "a", 2: "b"}),
+                             ("seed", [0])], experiment_f, str(tmp_path / "sets"))
+    assert sorted((kwargs["mean"], kwargs["sigma"]) for kwargs in experiment.iter_values()) == [(1, 1), (1, 2),
+                                                                                             (2, 1), (2, 2)]
+    assert RangeVariable("n", 10, 0, -3).get_standard() == GridVariable("n", [10, 7, 4, 1]).get_standard()
+    # Variables which are not grids
+    experiment = Experiment([IterableVariable("mean", [1, 2, 4]), RangeVariable("sigma", 1, 3)],
+                            experiment_f, str(tmp_path / "iterable"), strategy="urinal")
+    assert sorted((kwargs["mean"], kwargs["sigma"]) for kwargs in experiment.iter_values()) == [
+        (mean, sigma) for mean in [1, 2, 4] for sigma in [1, 2]]
+
+    variables = [RangeVariable("mean", 1, 4), LogSpaceVariable("sigma", 0, 1, 3), RangeVariable("seed", 2)]
+    for strategy in ["grid", "urinal", "star"]:
+        experiment = Experiment(variables, experiment_f, str(tmp_path), strategy=strategy, mid_point=None if
+                                strategy != "star" else {"mean": 2, "sigma": 10 ** 0.5, "seed": 0})
+        experiment.run_all()
+        assert len(experiment.get_results_df()) == len(experiment)
+        assert all(experiment._grid_point(kwargs) is not None for kwargs in experiment.iter_values())
+
+
+def test_zoo_n_estimators(tmp_path):
+    """Test ensembles are grown through the values of n_estimators in a single fit, storing each value as a trial"""
+    from silico.ml import zoo_experiment
+    random.seed(0)
+    X = random.normal(size=(80, 3))
+    y = (X[:, 0] + X[:, 1] > 0).astype(int)
+    experiment = zoo_experiment({"sum": (X, y)}, ["random-forest", "logistic"], str(tmp_path / "warm"), n_splits=2,
+                                n_estimators=[20, 5, 10])
+    assert len(experiment) == 12
+    # The largest values store the smaller ones
+    for kwargs in experiment.iter_values():
+        if kwargs["n_estimators"] == 20:
+            experiment._run_trial(kwargs)
+    assert experiment.status() == {"total": 12, "done": 12, "errors": 0}
+    experiment.run_all(method="threading", threads=3)
+    df = experiment.get_results_df().sort_index()
+    assert len(df) == 12
+    assert df.xs(("logistic", "sum", 0, 0), level=["model", "dataset", "fold", "seed"])["Accuracy"].nunique() == 1
+    fit_seconds = df.xs(("random-forest", "sum", 0, 0), level=["model", "dataset", "fold", "seed"])["fit_seconds"]
+    assert fit_seconds.is_monotonic_increasing
+    assert len(experiment.aggregate(["model", "n_estimators"], columns=["Accuracy"])) == 6
+
+    # Results of other configurations in the same store are not reused
+    store = str(tmp_path / "warm")
+    same = zoo_experiment({"sum": (X, y)}, ["random-forest", "logistic"], store, n_splits=2, n_estimators=[5, 10, 20])
+    assert same.status()["done"] == 12
+    for other in [zoo_experiment({"sum": (X, y)}, ["random-forest", "logistic"], store, n_splits=3,
+                                 n_estimators=[5, 10, 20]),
+                  zoo_experiment({"sum": (X, 1 - y)}, ["random-forest", "logistic"], store, n_splits=2,
+                                 n_estimators=[5, 10, 20]),
+                  zoo_experiment({"sum": (X, y)}, ["random-forest", "logistic"], store, n_splits=2)]:
+        assert other.status()["done"] == 0
+
+    # Same results as fitting from scratch
+    scratch = zoo_experiment({"sum": (X, y)}, ["random-forest"], str(tmp_path / "scratch"), n_splits=2,
+                             model_kwargs={"random-forest": {"n_estimators": 10}})
+    result = scratch.get_result({"model": "random-forest", "dataset": "sum", "fold": 1, "seed": 0})
+    assert result["Accuracy"] == df.loc[(10, "random-forest", "sum", 1, 0), "Accuracy"]
+
+
+def test_memoize(tmp_path):
+    """Test intermediate results are computed once, memory-mapped and evicted when exceeding the size"""
+    import numpy as np
+    from silico.cache import memoize
+
+    calls = []
+
+    @memoize(str(tmp_path / "cache"), max_bytes=20000)
+    def preprocess(dataset, fold=0):
+        calls.append((dataset, fold))
+        return {"X": np.full((1000,), fold, dtype=float), "name": dataset}
+
+    result = preprocess("a", fold=1)
+    assert isinstance(result["X"], np.memmap) and result["X"][0] == 1 and result["name"] == "a"
+    assert preprocess("a", 1)["X"].sum() == 1000
+    assert calls == [("a", 1)]
+
+    preprocess("b")
+    preprocess("a", 1)  # Now more recently used than b
+    preprocess("c")  # Exceeds the size, evicting b
+    preprocess("a", 1)
+    preprocess("b")
+    assert calls == [("a", 1), ("b", 0), ("c", 0), ("b", 0)]
+
+    preprocess.cache.clear()
+    preprocess("a", 1)
+    assert len(calls) == 5
+
+
+def generate_f(x):
+    import time
+    if x == 3:
+        time.sleep(1)
+    elif x == 2:
+        raise ValueError("Generation failed")
+    return {"data": x * 10, "end": time.time()}
+
+
+def train_f(x, lr, data):
+    import time
+    return {"model": data["data"] + lr, "end": time.time()}
+
+
+def evaluate_f(x, lr, model):
+    return {"score": model["model"] * 2}
+
+
+def test_pipeline(tmp_path):
+    """Test trials start when the trials providing their inputs finish"""
+    from silico import Pipeline
+
+    generate = Experiment([("x", list(range(4)))], generate_f, str(tmp_path))
+    train = Experiment([("x", list(range(4))), ("lr", [1, 2])], train_f, str(tmp_path))
+    evaluate = Experiment([("x", list(range(4))), ("lr", [1, 2])], evaluate_f, str(tmp_path))
+    pipeline = Pipeline()
+    pipeline.add(generate)
+    pipeline.add(train, inputs={"data": (generate, None)})
+    pipeline.add(evaluate, inputs={"model": (train, lambda kwargs: kwargs)})
+    pipeline.run(method="multithreading", threads=2)
+
+    assert train.get_result({"x": 0, "lr": 1})["end"] < generate.get_result({"x": 3})["end"]
+    assert evaluate.get_result({"x": 3, "lr": 2})["score"] == 64
+    assert evaluate.status() == {"total": 8, "done": 8, "errors": 2}
+    assert "Generation failed" in evaluate.get_result({"x": 2, "lr": 1})["_error"]
+
+    # Available results are reused
+    train.invalidate(where=lambda kwargs: kwargs["x"] == 0)
+    evaluate.invalidate(where=lambda kwargs: kwargs["x"] == 0)
+    start = generate.get_result({"x": 3})["_run_start"]
+    pipeline.run(method="threading")
+    assert generate.get_result({"x": 3})["_run_start"] == start
+    assert evaluate.status()["done"] == 8
+
+    evaluate.invalidate(where=lambda kwargs: kwargs["x"] == 1)
+    pipeline.run()
+    assert evaluate.get_result({"x": 1, "lr": 1})["score"] == 22
+
+    # Missing inputs are stored as errors
+    train._run_trial({"x": 9, "lr": 1}, inputs={"data": generate._trial({"x": 9})})
+    assert train.get_result({"x": 9, "lr": 1})["_error"].startswith("Input trial not available (data)")
+
+
+def test_pipeline_storage(tmp_path):
+    """Test results written behind reach the trials using them in other processes"""
+    from silico import Pipeline
+
+    generate = Experiment([("x", list(range(4)))], generate_f, str(tmp_path), write_behind=True)
+    train = Experiment([("x", list(range(4))), ("lr", [1, 2])], train_f, str(tmp_path), write_behind=True)
+    pipeline = Pipeline()
+    pipeline.add(generate)
+    pipeline.add(train, inputs={"data": (generate, None)})
+    pipeline.run(method="multithreading", threads=2)
+    assert train.status() == {"total": 8, "done": 8, "errors": 2}
+    assert train.get_result({"x": 3, "lr": 2})["model"] == 32
+
+    memory = Pipeline()
+    memory.add(Experiment([("x", [0])], generate_f, str(tmp_path / "memory"), storage="memory"))
+    try:
+        memory.run(method="multithreading")
+        assert False, "Not raised"
+    except ValueError:
+        pass
+
+
+def checkpointed_failing_f(x, checkpoint):
+    checkpoint.save({"x": x})
+    if x == 1:
+        raise ValueError("An example error raised when x==1")
+    return {"x": x}
+
+
+def test_memory_storage(tmp_path):
+    """Test results kept in memory, spilled to disk when exceeding the size and persisted on demand"""
+    variables = [("mean", [1, 2]), ("sigma", [1]), ("seed", list(range(10)))]
+    experiment = Experiment(variables, experiment_f, str(tmp_path), storage="memory")
+    experiment.run_all(method="threading")
+    assert not list(tmp_path.glob("*.pkl"))
+    assert experiment.status() == {"total": 20, "done": 20, "errors": 0}
+    assert len(experiment.get_results_df()) == 20
+    assert experiment.aggregate(["mean"], processes=2).loc[2, ("value", "count")] == 10
+
+    experiment.persist()
+    assert len(list(tmp_path.glob("*.pkl"))) == 20
+    assert len(Experiment(variables, experiment_f, str(tmp_path)).get_results_df()) == 20
+
+    experiment.invalidate()
+    size = len(pickle.dumps(experiment.get_result({"mean": 1, "sigma": 1, "seed": 0})))
+    experiment = Experiment(variables, experiment_f, str(tmp_path), storage="memory", max_memory=5 * size)
+    experiment.run_all()
+    assert 10 <= len(list(tmp_path.glob("*.pkl"))) < 20
+    assert len(experiment.get_results_df()) == 20
+
+    # Checkpoints and error records are kept in memory too
+    store = tmp_path / "failing"
+    experiment = Experiment([("x", [0, 1, 2])], checkpointed_failing_f, str(store), storage="memory",
+                            checkpoint_arg="checkpoint")
+    experiment.run_all()
+    experiment.run_all(retry_errors=True)
+    assert not list(store.iterdir())
+    assert experiment._errored_trials() == [({"x": 1}, 2)]
+    assert experiment._trial({"x": 1}).get_checkpoint().load() == {"x": 1}
+    experiment.persist()
+    assert sorted(path.suffix for path in store.iterdir()) == [".ckpt", ".err", ".pkl", ".pkl", ".pkl"]